@@ -11,6 +11,8 @@ class ChatbotConfig(AppConfig):
     
     def ready(self):
         """Initialize vector store when Django starts (lazy)"""
+        from . import signals  # noqa: F401  (registers the receivers)
+
         try:
             from .rag.vectorstore import initialize_vectorstore
             initialize_vectorstore()
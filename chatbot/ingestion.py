@@ -0,0 +1,136 @@
+# chatbot/ingestion.py
+
+"""
+Background document ingestion.
+
+Uploads are saved as Document rows with status "pending"; those rows are the
+job queue. A small in-process thread pool claims a pending document with a
+conditional UPDATE (so two workers never process the same one), extracts,
+chunks and embeds it, and records progress on the row for the status endpoint.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Document, DocumentChunk
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _claim(document_id):
+    """Atomically move a queued (or stale in-progress) document to processing"""
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=getattr(settings, "INGESTION_STALE_SECONDS", 600))
+    claimed = Document.objects.filter(
+        Q(status=Document.STATUS_PENDING)
+        | Q(status=Document.STATUS_PROCESSING, status_updated_at__lt=stale_before),
+        id=document_id,
+    ).update(status=Document.STATUS_PROCESSING, progress=0, error="", status_updated_at=now)
+    return claimed == 1
+
+
+def _set_status(document_id, **fields):
+    Document.objects.filter(id=document_id).update(status_updated_at=timezone.now(), **fields)
+
+
+def process_document(document_id):
+    """Run ingestion for one queued document. Safe to call for any id."""
+    from .rag.rag_pipeline import ingest_document
+
+    try:
+        if not _claim(document_id):
+            return
+        # A reclaimed job (its worker died or stalled) starts over from chunk 0;
+        # drop what the previous attempt saved so no chunk is stored twice
+        DocumentChunk.objects.filter(document_id=document_id).delete()
+        doc = Document.objects.select_related("user").get(id=document_id)
+        print(f"⚙️ [Ingestion] Processing document {document_id}...")
+
+        def report(done, total):
+            _set_status(document_id, progress=int(100 * done / total) if total else 100)
+
+        with doc.file.open("rb") as f:
+            added = ingest_document(doc.user, f, doc.id, progress_callback=report)
+
+        if added:
+            _set_status(document_id, status=Document.STATUS_READY, progress=100)
+        else:
+            _set_status(document_id, status=Document.STATUS_FAILED, error="No text could be extracted")
+    except Document.DoesNotExist:
+        print(f"🗑️ [Ingestion] Document {document_id} was deleted; stopping.")
+    except Exception as e:
+        print(f"❌ [Ingestion] Document {document_id} failed: {e}")
+        _set_status(document_id, status=Document.STATUS_FAILED, error=str(e)[:1000])
+
+
+def _run_job(document_id):
+    """Worker-thread entry point; the thread owns its own DB connection"""
+    try:
+        process_document(document_id)
+    finally:
+        close_old_connections()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # Jobs left queued by a previous process (if this query fails,
+                # the next call tries again)
+                pending = pending_document_ids()
+                executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "INGESTION_WORKERS", 1),
+                    thread_name_prefix="ingestion",
+                )
+                for document_id in pending:
+                    executor.submit(_run_job, document_id)
+                _executor = executor
+    return _executor
+
+
+def resume_ingestion():
+    """
+    Start the pool, which re-queues documents a previous process left pending
+    or stalled. Called when a web process starts (see asgi.py) so they do not
+    wait for the next upload.
+    """
+    if not getattr(settings, "INGESTION_ASYNC", True):
+        return
+    try:
+        _get_executor()
+    except Exception as e:
+        print(f"⚠️ [Ingestion] Could not resume queued documents: {e}")
+    finally:
+        close_old_connections()
+
+
+def pending_document_ids():
+    """Queued documents, plus in-progress ones whose worker stopped reporting"""
+    stale_before = timezone.now() - timedelta(seconds=getattr(settings, "INGESTION_STALE_SECONDS", 600))
+    return list(
+        Document.objects.filter(
+            Q(status=Document.STATUS_PENDING)
+            | Q(status=Document.STATUS_PROCESSING, status_updated_at__lt=stale_before)
+        )
+        .order_by("uploaded_at")
+        .values_list("id", flat=True)
+    )
+
+
+def enqueue_ingestion(document_id):
+    """
+    Queue a pending document for ingestion once the current transaction commits.
+    With settings.INGESTION_ASYNC off, ingestion runs inline instead.
+    """
+    if not getattr(settings, "INGESTION_ASYNC", True):
+        transaction.on_commit(lambda: process_document(document_id))
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run_job, document_id))
@@ -0,0 +1,88 @@
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+SAMPLE_SENTENCES = [
+    "The quarterly report shows revenue growth across all regions.",
+    "Reset your password from the account settings page.",
+    "Photosynthesis converts light energy into chemical energy.",
+    "The contract terminates automatically after twelve months.",
+    "Add the eggs one at a time and beat well after each.",
+]
+
+
+def _sample_texts(count):
+    """Chunk-sized texts (~200 words) built from varied sentences"""
+    texts = []
+    for i in range(count):
+        words = " ".join(SAMPLE_SENTENCES[(i + j) % len(SAMPLE_SENTENCES)] for j in range(16))
+        texts.append(f"Chunk {i}. {words}")
+    return texts
+
+
+def _rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(backend, count, batch_size):
+    """Runs in a fresh process so load time and RSS belong to one backend only"""
+    import django
+    django.setup()
+    from chatbot.rag.embeddings import load_embedding_model
+
+    baseline = _rss_mb()
+    started = time.perf_counter()
+    model = load_embedding_model(backend)
+    load_seconds = time.perf_counter() - started
+    texts = _sample_texts(count)
+    model.encode(texts[:batch_size], batch_size=batch_size, show_progress_bar=False)  # warm-up
+
+    started = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    encode_seconds = time.perf_counter() - started
+    return {
+        "backend": type(model).__name__,
+        "load_seconds": load_seconds,
+        "chunks_per_sec": count / encode_seconds if encode_seconds > 0 else float("inf"),
+        "rss_mb": _rss_mb(),
+        "model_rss_mb": _rss_mb() - baseline,
+        "sample": np.asarray(embeddings[:64], dtype=np.float32),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compare embedding backends: load time, throughput, peak RSS and agreement with torch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', default=['torch', 'onnx'])
+        parser.add_argument('--chunks', type=int, default=256, help='Chunks to embed per backend')
+        parser.add_argument('--batch-size', type=int, default=32)
+
+    def handle(self, *args, **options):
+        # "spawn" gives every backend a clean process (no shared imports or RSS)
+        context = multiprocessing.get_context("spawn")
+        results = {}
+        for backend in options['backends']:
+            self.stdout.write(f'⏱️ Measuring {backend} backend...')
+            with context.Pool(1) as pool:
+                try:
+                    results[backend] = pool.apply(_measure, (backend, options['chunks'], options['batch_size']))
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'❌ {backend} failed: {e}'))
+
+        reference = results.get('torch')
+        for backend, r in results.items():
+            line = (
+                f'{backend:>6} ({r["backend"]}): load {r["load_seconds"]:.2f}s, '
+                f'{r["chunks_per_sec"]:.1f} chunks/sec, peak RSS {r["rss_mb"]:.0f} MB '
+                f'(+{r["model_rss_mb"]:.0f} MB for the model)'
+            )
+            if reference is not None and backend != 'torch':
+                a, b = reference["sample"], r["sample"]
+                cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+                line += f', cosine vs torch min {cosine.min():.4f} / mean {cosine.mean():.4f}'
+            self.stdout.write(self.style.SUCCESS(line))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from chatbot.rag.rag_pipeline import GLOBAL_VECTOR_STORE
+
+
+class Command(BaseCommand):
+    help = 'Drop the chunks of deleted documents from the vector store files and index'
+
+    def handle(self, *args, **options):
+        removed = GLOBAL_VECTOR_STORE.compact()
+        self.stdout.write(self.style.SUCCESS(
+            f'🧹 Removed {removed} deleted chunks; {len(GLOBAL_VECTOR_STORE.texts)} chunks remain'
+        ))
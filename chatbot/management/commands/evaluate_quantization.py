@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from chatbot.rag.indexes import QuantizedIndex, exact_search, top_k_indices
+
+
+def _normalize(rows):
+    norms = np.linalg.norm(rows, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (rows / norms).astype(np.float32)
+
+
+def _synthetic_matrix(rows, dim, rng):
+    """Unit rows scattered around a few hundred topics, like chunks of many documents"""
+    centers = rng.standard_normal((max(rows // 200, 8), dim))
+    points = centers[rng.integers(0, len(centers), rows)] + 0.6 * rng.standard_normal((rows, dim))
+    return _normalize(points)
+
+
+def _sample_queries(matrix, count, rng):
+    """
+    Midpoints of random pairs of stored rows: close to real rows without being
+    one, so the exact top-k is not just the query's own row.
+    """
+    first = matrix[rng.integers(0, len(matrix), count)]
+    second = matrix[rng.integers(0, len(matrix), count)]
+    return _normalize(np.asarray(first) + np.asarray(second))
+
+
+def _run(search, queries):
+    """Top rows per query and the mean latency in ms"""
+    started = time.perf_counter()
+    results = [search(query) for query in queries]
+    return results, (time.perf_counter() - started) * 1000 / len(queries)
+
+
+def _recall(results, expected):
+    return float(np.mean([len(set(rows) & set(truth)) / len(truth) for rows, truth in zip(results, expected)]))
+
+
+class Command(BaseCommand):
+    help = 'Recall, memory and latency of float16/int8 quantized search against exact float32 search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='Evaluate on this many random rows instead of the vector store')
+        parser.add_argument('--dim', type=int, default=384, help='Dimension of --synthetic rows')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--rerank', type=int, nargs='+', default=[20, 100, 400],
+                            help='rerank_candidates values to try')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        top_k = options['top_k']
+        if options['synthetic']:
+            matrix = _synthetic_matrix(options['synthetic'], options['dim'], rng)
+            source = f'{len(matrix)} synthetic rows'
+        else:
+            from chatbot.rag.rag_pipeline import GLOBAL_VECTOR_STORE
+            matrix = GLOBAL_VECTOR_STORE.embeddings
+            source = f'{len(matrix)} rows of {GLOBAL_VECTOR_STORE.persist_path or "the vector store"}'
+        if len(matrix) <= top_k:
+            raise CommandError('Not enough rows to evaluate; load documents or pass --synthetic N')
+
+        queries = _sample_queries(matrix, options['queries'], rng)
+        self.stdout.write(f'📏 {len(queries)} queries, top {top_k}, over {source}')
+
+        exact, exact_ms = _run(lambda q: exact_search(matrix, q, top_k)[0], queries)
+        matrix_mb = len(matrix) * matrix.shape[1] * 4 / 2**20
+        self.stdout.write(self.style.SUCCESS(
+            f' float32 exact: recall 1.0000, {exact_ms:.2f} ms/query, {matrix_mb:.1f} MB scored per query'
+        ))
+
+        for name in ('float16', 'int8'):
+            index = QuantizedIndex(name).rebuild(matrix)
+            codes_mb = index.codes.nbytes / 2**20
+            coarse, coarse_ms = _run(
+                lambda q: top_k_indices(index.quantizer.scores(index.codes, q), top_k), queries
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'{name:>7} codes only: recall {_recall(coarse, exact):.4f}, {coarse_ms:.2f} ms/query, '
+                f'{codes_mb:.1f} MB of codes ({codes_mb / matrix_mb:.0%} of float32)'
+            ))
+            for rerank in options['rerank']:
+                index.options = {'rerank_candidates': rerank}
+                results, ms = _run(lambda q: index.search(matrix, q, top_k)[0], queries)
+                shortlist = max(2 * top_k, rerank)
+                self.stdout.write(self.style.SUCCESS(
+                    f'{name:>7} + rerank {shortlist:>4}: recall {_recall(results, exact):.4f}, {ms:.2f} ms/query, '
+                    f'{shortlist * matrix.shape[1] * 4 / 1024:.0f} KB of float32 rows read per query'
+                ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from chatbot.ingestion import pending_document_ids, process_document
+from chatbot.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Ingest all queued documents in the foreground'
+
+    def handle(self, *args, **options):
+        document_ids = pending_document_ids()
+        self.stdout.write(f'📥 {len(document_ids)} documents queued for ingestion')
+
+        for document_id in document_ids:
+            process_document(document_id)
+            doc = Document.objects.filter(id=document_id).only('status', 'error').first()
+            if doc is None:
+                continue
+            if doc.status == Document.STATUS_READY:
+                self.stdout.write(self.style.SUCCESS(f'✅ Document {document_id} ready'))
+            else:
+                self.stdout.write(self.style.ERROR(f'❌ Document {document_id} {doc.status}: {doc.error}'))
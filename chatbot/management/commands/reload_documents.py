@@ -1,66 +1,73 @@
-from django.core.management.base import BaseCommand
-from chatbot.models import Document
-from chatbot.rag.vectorstore import initialize_vectorstore
-from chatbot.rag.rag_pipeline import chunk_text
-
-
-class Command(BaseCommand):
-    help = 'Reload all documents from database into the vector store'
-
-    def handle(self, *args, **options):
-        self.stdout.write('🔄 Reloading documents into vector store...')
-        
-        # Initialize vector store
-        vectorstore = initialize_vectorstore()
-        
-        # Check if model can load
-        vectorstore._load_model()
-        if vectorstore.model is None:
-            self.stdout.write(self.style.ERROR('❌ Failed to load SentenceTransformer model'))
-            return
-        
-        # Get all documents with extracted text
-        documents = Document.objects.filter(
-            extracted_text__isnull=False
-        ).exclude(extracted_text='')
-        
-        total_count = documents.count()
-        self.stdout.write(f'📄 Found {total_count} documents with extracted text')
-        
-        if total_count == 0:
-            self.stdout.write(self.style.WARNING('⚠️ No documents to reload'))
-            return
-        
-        reloaded_count = 0
-        total_chunks = 0
-        
-        for doc in documents:
-            try:
-                if doc.extracted_text:
-                    chunks = chunk_text(doc.extracted_text)
-                    fname = doc.file.name.split('/')[-1] if doc.file.name else f'doc_{doc.id}'
-                    wrapped_chunks = [
-                        f"[DOCUMENT_ID={doc.id} FILENAME={fname}]\n{chunk}"
-                        for chunk in chunks
-                    ]
-                    vectorstore.add_texts(
-                        texts=wrapped_chunks,
-                        metadata={
-                            "user_id": doc.user.id,
-                            "filename": fname,
-                        }
-                    )
-                    reloaded_count += 1
-                    total_chunks += len(chunks)
-                    self.stdout.write(f'✅ Reloaded: {fname} ({len(chunks)} chunks)')
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'❌ Error reloading document {doc.id}: {e}')
-                )
-        
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'\n✅ Successfully reloaded {reloaded_count}/{total_count} documents '
-                f'({total_chunks} total chunks)'
-            )
-        )
+import time
+
+from django.core.management.base import BaseCommand
+from chatbot.models import Document
+from chatbot.rag.vectorstore import initialize_vectorstore
+from chatbot.rag.rag_pipeline import document_filename, load_document_chunks
+
+
+class Command(BaseCommand):
+    help = 'Reload all documents from database into the vector store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Chunks per embedding batch (defaults to settings.EMBEDDING_BATCH_SIZE)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('🔄 Reloading documents into vector store...')
+        
+        # Initialize vector store
+        vectorstore = initialize_vectorstore()
+        
+        # Stored DocumentChunk embeddings are loaded without the model; it is
+        # only needed for documents ingested before chunks were persisted.
+        # extracted_text itself is deferred: it is only read for documents
+        # that have to be re-chunked
+        documents = Document.objects.filter(
+            extracted_text__isnull=False
+        ).exclude(extracted_text='').defer('extracted_text')
+        
+        total_count = documents.count()
+        self.stdout.write(f'📄 Found {total_count} documents with extracted text')
+        
+        if total_count == 0:
+            self.stdout.write(self.style.WARNING('⚠️ No documents to reload'))
+            return
+        
+        reloaded_count = 0
+        total_chunks = 0
+        started = time.perf_counter()
+        
+        for doc in documents:
+            try:
+                fname = document_filename(doc)
+                if vectorstore.has_document(doc.id):
+                    self.stdout.write(f'⏭️ Already loaded: {fname}')
+                    continue
+                doc_started = time.perf_counter()
+                added = load_document_chunks(doc, batch_size=options['batch_size'])
+                doc_elapsed = time.perf_counter() - doc_started
+                rate = added / doc_elapsed if doc_elapsed > 0 else 0.0
+                if added:
+                    reloaded_count += 1
+                    total_chunks += added
+                    self.stdout.write(f'✅ Reloaded: {fname} ({added} chunks, {rate:.1f} chunks/sec)')
+                else:
+                    self.stdout.write(self.style.ERROR(f'❌ Could not reload {fname}'))
+            except Exception as e:
+                self.stdout.write(
+                    self.style.ERROR(f'❌ Error reloading document {doc.id}: {e}')
+                )
+        
+        elapsed = time.perf_counter() - started
+        rate = total_chunks / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n✅ Successfully reloaded {reloaded_count}/{total_count} documents '
+                f'({total_chunks} total chunks, {rate:.1f} chunks/sec)'
+            )
+        )
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from chatbot.rag.embedding_server import EmbeddingServer
+from chatbot.rag.embeddings import warmup
+
+
+class Command(BaseCommand):
+    help = 'Serve embeddings for all web workers from one model over a Unix socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=None, help='Defaults to settings.EMBEDDING_SERVER_SOCKET')
+        parser.add_argument('--max-batch', type=int, default=None)
+        parser.add_argument('--max-wait-ms', type=float, default=None)
+
+    def handle(self, *args, **options):
+        socket_path = options['socket'] or settings.EMBEDDING_SERVER_SOCKET
+        if not socket_path:
+            raise CommandError('Set EMBEDDING_SERVER_SOCKET or pass --socket')
+
+        # This process is the server: load the model itself, never a client
+        model = warmup(use_server=False)
+        if model is None:
+            raise CommandError('Embedding model could not be loaded')
+
+        server = EmbeddingServer(
+            socket_path,
+            model,
+            max_batch=options['max_batch'] or settings.EMBEDDING_SERVER_MAX_BATCH,
+            max_wait_ms=options['max_wait_ms'] if options['max_wait_ms'] is not None
+            else settings.EMBEDDING_SERVER_MAX_WAIT_MS,
+            batch_size=settings.EMBEDDING_BATCH_SIZE,
+        )
+        self.stdout.write(self.style.SUCCESS(f'🔌 Embedding server listening on {socket_path}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(
+                f'🛑 Embedding server stopped ({server.batcher.texts} texts in {server.batcher.batches} batches)'
+            )
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0002_chatmessage_document'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='documentchunk',
+            options={'ordering': ['document', 'ordinal']},
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='ordinal',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # The JSON column was never written, and jsonb cannot be cast to bytea,
+        # so drop and re-add it instead of altering in place.
+        migrations.RemoveField(
+            model_name='documentchunk',
+            name='embedding',
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embedding',
+            field=models.BinaryField(default=b''),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='documentchunk',
+            index=models.Index(fields=['document', 'ordinal'], name='chunk_document_ordinal_idx'),
+        ),
+    ]
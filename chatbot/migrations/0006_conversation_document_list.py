@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+def fill_document_list(apps, schema_editor):
+    # Same order and de-duplication the chat view used to compute per message
+    Conversation = apps.get_model('chatbot', 'Conversation')
+    ChatMessage = apps.get_model('chatbot', 'ChatMessage')
+    lists = {}
+    messages = (
+        ChatMessage.objects.filter(message_type='document', document__isnull=False)
+        .order_by('conversation_id', 'created_at')
+        .values_list('conversation_id', 'document_id', 'uploaded_file_name')
+    )
+    for conversation_id, document_id, name in messages.iterator():
+        entries = lists.setdefault(conversation_id, [])
+        if all(entry['id'] != document_id for entry in entries):
+            entries.append({'id': document_id, 'name': name})
+    for conversation_id, entries in lists.items():
+        Conversation.objects.filter(id=conversation_id).update(document_list=entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_chat_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='document_list',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(fill_document_list, migrations.RunPython.noop),
+    ]
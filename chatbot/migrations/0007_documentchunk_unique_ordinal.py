@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:05
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def drop_duplicate_chunks(apps, schema_editor):
+    # Re-run ingestions stored some (document, ordinal) pairs twice; keep the first row
+    DocumentChunk = apps.get_model('chatbot', 'DocumentChunk')
+    duplicates = (
+        DocumentChunk.objects.values('document_id', 'ordinal')
+        .annotate(keep=Min('id'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates.iterator():
+        DocumentChunk.objects.filter(
+            document_id=dup['document_id'], ordinal=dup['ordinal']
+        ).exclude(id=dup['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_conversation_document_list'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_chunks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='documentchunk',
+            name='chunk_document_ordinal_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='documentchunk',
+            constraint=models.UniqueConstraint(fields=('document', 'ordinal'), name='chunk_document_ordinal_uniq'),
+        ),
+    ]
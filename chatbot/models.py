@@ -1,10 +1,23 @@
-from django.db import models
+import numpy as np
+from django.db import models, transaction
 from django.conf import settings
 
 # ==============================
 # 📄 Document Model
 # ==============================
 class Document(models.Model):
+    # Ingestion status; pending rows double as the background job queue
+    STATUS_PENDING = "pending"
+    STATUS_PROCESSING = "processing"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_PROCESSING, "Processing"),
+        (STATUS_READY, "Ready"),
+        (STATUS_FAILED, "Failed"),
+    )
+
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -14,6 +27,11 @@ class Document(models.Model):
     extracted_text = models.TextField(blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    progress = models.PositiveSmallIntegerField(default=0)  # percent of chunks embedded
+    error = models.TextField(blank=True)
+    status_updated_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return self.file.name
 
@@ -24,13 +42,29 @@ class DocumentChunk(models.Model):
         on_delete=models.CASCADE,
         related_name="chunks"
     )
+    ordinal = models.PositiveIntegerField(default=0)  # position within the document
     content = models.TextField()
-    embedding = models.JSONField()  # vector
+    embedding = models.BinaryField()  # raw float32 vector bytes
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ["document", "ordinal"]
+        constraints = [
+            # One row per chunk position; also the (document, ordinal) lookup index
+            models.UniqueConstraint(fields=["document", "ordinal"], name="chunk_document_ordinal_uniq"),
+        ]
+
     def __str__(self):
         return f"Chunk {self.id} of {self.document.file.name}"
 
+    @staticmethod
+    def pack_embedding(vector):
+        return np.asarray(vector, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def unpack_embedding(raw):
+        return np.frombuffer(bytes(raw), dtype=np.float32)
+
 
 # ==============================
 # 💬 Conversation Model
@@ -53,11 +87,52 @@ class Conversation(models.Model):
         related_name="active_in_conversations"
     )
 
+    # Documents uploaded to this chat, in upload order: [{"id": ..., "name": ...}].
+    # Denormalized from the document messages so a chat message needs no query for them.
+    document_list = models.JSONField(default=list, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at"], name="conversation_user_created_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
+    def add_document(self, document, name):
+        """
+        Append a document to document_list (once) and save the list. The row is
+        re-read under a row lock, so concurrent uploads to the chat (or a
+        deleted document being pruned) do not overwrite each other's changes.
+        """
+        with transaction.atomic():
+            document_list = (
+                Conversation.objects.select_for_update()
+                .values_list("document_list", flat=True)
+                .get(pk=self.pk)
+            )
+            if all(entry["id"] != document.id for entry in document_list):
+                document_list = [*document_list, {"id": document.id, "name": name}]
+                Conversation.objects.filter(pk=self.pk).update(document_list=document_list)
+        self.document_list = document_list
+
+    @classmethod
+    def remove_document(cls, document):
+        """Drop a deleted document from the document_list of its owner's conversations"""
+        listed = [
+            conversation.pk
+            for conversation in cls.objects.filter(user_id=document.user_id).only("id", "document_list")
+            if any(entry["id"] == document.id for entry in conversation.document_list)
+        ]
+        if not listed:
+            return
+        with transaction.atomic():
+            for conversation in cls.objects.select_for_update().filter(pk__in=listed).only("id", "document_list"):
+                kept = [entry for entry in conversation.document_list if entry["id"] != document.id]
+                cls.objects.filter(pk=conversation.pk).update(document_list=kept)
+
 
 # ==============================
 # 🗨️ Chat Message Model 
@@ -105,6 +180,13 @@ class ChatMessage(models.Model):
 
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Chat history (text messages) and document messages of one conversation, by time
+            models.Index(fields=["conversation", "message_type", "created_at"], name="chatmsg_conv_type_created_idx"),
+            models.Index(fields=["conversation", "created_at"], name="chatmsg_conv_created_idx"),
+        ]
+
     def __str__(self):
         if self.message_type == "document":
             return f"Document: {self.uploaded_file_name}"
@@ -1,8 +1,18 @@
+import asyncio
+import hashlib
 import os
 import re
-from openai import OpenAI
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.cache import caches
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI, Timeout
 
 MODEL_NAME = "openai/gpt-oss-20b"  # Groq-hosted OSS model
+TEMPERATURE = 0.4
+MAX_OUTPUT_TOKENS = 700
 
 def clean_llm_response(text):
     if not text:
@@ -34,19 +44,65 @@ def clean_llm_response(text):
 
     return text.strip()
 
-def get_client():
+BASE_URL = "https://api.groq.com/openai/v1"
+
+_client = None
+_client_lock = threading.Lock()
+# One async client per event loop (a single one under the ASGI server)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _api_key():
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise RuntimeError("GROQ_API_KEY is not set")
+    return api_key
 
-    return OpenAI(
-        api_key=api_key,
-        base_url="https://api.groq.com/openai/v1",
-    )
 
-def get_ai_reply(message, history_text="", document_text="", doc_manifest=None):
-    client = get_client()
+def _http_options():
+    """Connection pool limits and timeouts shared by the sync and async clients"""
+    return {
+        "limits": httpx.Limits(
+            max_connections=getattr(settings, "LLM_MAX_CONNECTIONS", 200),
+            max_keepalive_connections=getattr(settings, "LLM_MAX_KEEPALIVE_CONNECTIONS", 50),
+        ),
+        "timeout": Timeout(
+            getattr(settings, "LLM_TIMEOUT_SECONDS", 60.0),
+            connect=getattr(settings, "LLM_CONNECT_TIMEOUT_SECONDS", 5.0),
+        ),
+    }
 
+
+def get_client():
+    """Process-wide OpenAI client; its keep-alive pool is reused across requests"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenAI(
+                    api_key=_api_key(),
+                    base_url=BASE_URL,
+                    max_retries=getattr(settings, "LLM_MAX_RETRIES", 2),
+                    http_client=DefaultHttpxClient(**_http_options()),
+                )
+    return _client
+
+
+def get_async_client():
+    """AsyncOpenAI client for the running event loop, created once and reused"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=_api_key(),
+            base_url=BASE_URL,
+            max_retries=getattr(settings, "LLM_MAX_RETRIES", 2),
+            http_client=DefaultAsyncHttpxClient(**_http_options()),
+        )
+        _async_clients[loop] = client
+    return client
+
+def build_prompt(message, history_text="", document_text="", doc_manifest=None):
     # Generate a readable list of available documents
     inventory = "NONE"
     if doc_manifest:
@@ -75,17 +131,123 @@ USER QUESTION:
 
 ASSISTANT RESPONSE:
 """
+    return prompt
+
+
+# ----------------------------------------------------------------------
+# Answer cache (opt-in, settings.LLM_ANSWER_CACHE)
+# ----------------------------------------------------------------------
+def _answer_cache():
+    if not getattr(settings, "LLM_ANSWER_CACHE", False):
+        return None
+    return caches[getattr(settings, "LLM_ANSWER_CACHE_ALIAS", "llm")]
+
+
+def _answer_key(prompt):
+    """Identical prompts sent with identical generation settings share an answer"""
+    digest = hashlib.sha256(
+        f"{MODEL_NAME}\0{TEMPERATURE}\0{MAX_OUTPUT_TOKENS}\0{prompt}".encode("utf-8")
+    ).hexdigest()
+    return f"answer:{digest}"
+
+
+def _cache_answer(cache, key, raw_reply):
+    if cache is not None and raw_reply:
+        cache.set(key, raw_reply, getattr(settings, "LLM_ANSWER_CACHE_TTL", 3600))
+
+
+async def _acache_answer(cache, key, raw_reply):
+    if cache is not None and raw_reply:
+        await cache.aset(key, raw_reply, getattr(settings, "LLM_ANSWER_CACHE_TTL", 3600))
+
 
+def get_ai_reply(message, history_text="", document_text="", doc_manifest=None):
+    prompt = build_prompt(message, history_text, document_text, doc_manifest)
+    cache = _answer_cache()
+    key = _answer_key(prompt)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            print("💬 LLM answer cache hit")
+            return clean_llm_response(cached)
+
+    client = get_client()
     response = client.responses.create(
         model=MODEL_NAME,
         input=prompt,
-        temperature=0.4,
-        max_output_tokens=700, # Increased for better detail 
+        temperature=TEMPERATURE,
+        max_output_tokens=MAX_OUTPUT_TOKENS, # Increased for better detail 
+    )
+
+    raw_reply = _reply_text(response)
+    _cache_answer(cache, key, raw_reply)
+    return clean_llm_response(raw_reply)
+
+
+async def aget_ai_reply(message, history_text="", document_text="", doc_manifest=None):
+    """
+    Async version of get_ai_reply, using the pooled AsyncOpenAI client: a
+    request waiting on the model holds no thread, only a pooled connection.
+    """
+    prompt = build_prompt(message, history_text, document_text, doc_manifest)
+    cache = _answer_cache()
+    key = _answer_key(prompt)
+    if cache is not None:
+        cached = await cache.aget(key)
+        if cached is not None:
+            print("💬 LLM answer cache hit")
+            return clean_llm_response(cached)
+
+    client = get_async_client()
+    response = await client.responses.create(
+        model=MODEL_NAME,
+        input=prompt,
+        temperature=TEMPERATURE,
+        max_output_tokens=MAX_OUTPUT_TOKENS,
     )
 
+    raw_reply = _reply_text(response)
+    await _acache_answer(cache, key, raw_reply)
+    return clean_llm_response(raw_reply)
+
+
+def _reply_text(response):
     raw_reply = getattr(response, 'output_text', '')
     if not raw_reply and hasattr(response, 'choices'):
         # Fallback for standard OpenAI response structure
         raw_reply = response.choices[0].message.content
-
-    return clean_llm_response(raw_reply)
+    return raw_reply
+
+
+async def astream_ai_reply(message, history_text="", document_text="", doc_manifest=None):
+    """
+    Yield the reply as raw text deltas while the model generates it, using
+    the pooled AsyncOpenAI client. The concatenated deltas are unformatted;
+    pass them through clean_llm_response once the stream ends. A cached
+    answer is yielded as a single delta.
+    """
+    prompt = build_prompt(message, history_text, document_text, doc_manifest)
+    cache = _answer_cache()
+    key = _answer_key(prompt)
+    if cache is not None:
+        cached = await cache.aget(key)
+        if cached is not None:
+            print("💬 LLM answer cache hit")
+            yield cached
+            return
+
+    client = get_async_client()
+    stream = await client.responses.create(
+        model=MODEL_NAME,
+        input=prompt,
+        temperature=TEMPERATURE,
+        max_output_tokens=MAX_OUTPUT_TOKENS,
+        stream=True,
+    )
+    parts = []
+    async for event in stream:
+        if getattr(event, "type", "") == "response.output_text.delta" and event.delta:
+            parts.append(event.delta)
+            yield event.delta
+    # Only reached when the stream ran to completion
+    await _acache_answer(cache, key, "".join(parts))
@@ -0,0 +1,66 @@
+# chatbot/rag/cache.py
+
+"""
+Small in-process caches for retrieval.
+
+SimpleVectorStore keeps two of these: query text -> query embedding, and
+(query, filters, top_k, index version) -> ranked rows. The index version is
+bumped whenever rows are added or removed, so stale results are never served;
+they just age out of the LRU.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """Cache key for a query: surrounding and repeated whitespace do not change the meaning"""
+    return " ".join(str(query).split())
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with hit/miss counters"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,190 @@
+# chatbot/rag/chunking.py
+
+"""
+Sentence-aware chunking on character offsets.
+
+Text is cut into sentence units (start, end, tokens); units are packed
+greedily into chunks whose token count fits the embedding model's input
+window, so every chunk is embedded in full. Consecutive chunks share up to
+`overlap_tokens` worth of trailing sentences. Chunks are produced as
+(start, end) offsets into the original text; the text itself is only sliced
+when a caller needs the chunk string.
+"""
+
+import math
+import re
+
+from django.conf import settings
+
+# Sentence end: whitespace after terminal punctuation (optionally closed by a
+# quote or bracket), or a blank line
+SENTENCE_END = re.compile(r"(?:(?<=[.!?])|(?<=[.!?][\"')\]]))\s+|\n\s*\n")
+WORD = re.compile(r"\S+")
+TOKEN_ESTIMATE = re.compile(r"\w+|[^\w\s]")
+
+# A run without any sentence end is cut at a word boundary after this many chars
+MAX_SENTENCE_CHARS = 2000
+
+
+def estimate_tokens(texts):
+    """Rough word-piece count used when the model's tokenizer is unavailable"""
+    return [math.ceil(len(TOKEN_ESTIMATE.findall(text)) * 1.2) for text in texts]
+
+
+def _budget(max_tokens, overlap_tokens, count_tokens):
+    if not max_tokens:
+        max_tokens = getattr(settings, "CHUNK_MAX_TOKENS", 0) or 254
+    if overlap_tokens is None:
+        overlap_tokens = getattr(settings, "CHUNK_OVERLAP_TOKENS", 32)
+    return max_tokens, min(overlap_tokens, max_tokens // 2), count_tokens or estimate_tokens
+
+
+def _split_long(text, start, end, tokens, max_tokens, count_tokens, base=0):
+    """Cut a unit over the budget into word-aligned halves until each fits"""
+    if tokens <= max_tokens:
+        return [(start, end, tokens)]
+    words = list(WORD.finditer(text, start - base, end - base))
+    if len(words) < 2:
+        return [(start, end, tokens)]  # a single huge "word"; the model truncates it
+    middle = words[len(words) // 2].start() + base
+    halves = [(start, words[len(words) // 2 - 1].end() + base), (middle, end)]
+    counts = count_tokens([text[s - base:e - base] for s, e in halves])
+    units = []
+    for (s, e), n in zip(halves, counts):
+        units.extend(_split_long(text, s, e, n, max_tokens, count_tokens, base))
+    return units
+
+
+def _cut_run(text, start, stop, spans):
+    """Append [start, stop) to spans, cut at word boundaries into runs of at most MAX_SENTENCE_CHARS"""
+    while stop - start > MAX_SENTENCE_CHARS:
+        cut = text.rfind(" ", start + 1, start + MAX_SENTENCE_CHARS)
+        if cut == -1:
+            cut = start + MAX_SENTENCE_CHARS
+        spans.append((start, cut))
+        start = cut
+    if stop > start:
+        spans.append((start, stop))
+    return start
+
+
+def _sentence_spans(text, pos, end, final, base=0):
+    """
+    Spans of the complete sentences in text[pos:end], as absolute offsets.
+    Returns (spans, next_pos); the unfinished tail is left for the next call
+    unless `final` (a tail that is already too long is cut regardless).
+    """
+    spans = []
+    for match in SENTENCE_END.finditer(text, pos, end):
+        _cut_run(text, pos, match.start(), spans)
+        pos = match.end()
+    if final:
+        _cut_run(text, pos, end, spans)
+        pos = end
+    elif end - pos > MAX_SENTENCE_CHARS:
+        # Keep the last piece of a long run pending; it may continue
+        pending = []
+        pos = _cut_run(text, pos, end, pending)
+        spans.extend(pending[:-1])
+    return [(s + base, e + base) for s, e in spans], pos
+
+
+def _strip_span(text, start, end, base=0):
+    """Shrink a span so it starts and ends on non-whitespace"""
+    while start < end and text[start - base].isspace():
+        start += 1
+    while end > start and text[end - 1 - base].isspace():
+        end -= 1
+    return start, end
+
+
+def _units(text, spans, max_tokens, count_tokens, base=0):
+    """(start, end, tokens) units for sentence spans, long ones split to fit"""
+    spans = [_strip_span(text, s, e, base) for s, e in spans]
+    spans = [(s, e) for s, e in spans if e > s]
+    counts = count_tokens([text[s - base:e - base] for s, e in spans])
+    units = []
+    for (s, e), n in zip(spans, counts):
+        units.extend(_split_long(text, s, e, n, max_tokens, count_tokens, base))
+    return units
+
+
+def _pack(units, max_tokens, overlap_tokens):
+    """Greedily pack sentence units into (start, end) chunk spans within the budget"""
+    current = []
+    size = 0
+    for unit in units:
+        if current and size + unit[2] > max_tokens:
+            yield current[0][0], current[-1][1]
+            # Carry trailing sentences over as overlap, never the whole chunk
+            kept = []
+            kept_size = 0
+            for prev in reversed(current[1:]):
+                if kept_size + prev[2] > overlap_tokens:
+                    break
+                kept.insert(0, prev)
+                kept_size += prev[2]
+            while kept and kept_size + unit[2] > max_tokens:
+                kept_size -= kept.pop(0)[2]
+            current, size = kept, kept_size
+        current.append(unit)
+        size += unit[2]
+    if current:
+        yield current[0][0], current[-1][1]
+
+
+def chunk_spans(text, max_tokens=None, overlap_tokens=None, count_tokens=None):
+    """
+    Lazily yield (start, end) offsets of sentence-aligned chunks of `text`,
+    each at most `max_tokens` tokens as counted by `count_tokens(list_of_str)`.
+    """
+    max_tokens, overlap_tokens, count_tokens = _budget(max_tokens, overlap_tokens, count_tokens)
+
+    def units():
+        pos = 0
+        while pos < len(text):
+            # Find and count sentences a bounded window at a time
+            end = min(len(text), pos + 64 * MAX_SENTENCE_CHARS)
+            spans, pos = _sentence_spans(text, pos, end, final=end == len(text))
+            yield from _units(text, spans, max_tokens, count_tokens)
+
+    yield from _pack(units(), max_tokens, overlap_tokens)
+
+
+def iter_chunks(pieces, max_tokens=None, overlap_tokens=None, count_tokens=None):
+    """
+    Yield chunk strings from an iterable of text pieces (e.g.
+    loader.iter_document_text) as soon as they are complete, without joining
+    the pieces first. Only the text from the start of the current chunk is
+    kept in memory. Produces the same chunks as chunk_text on the
+    concatenated text.
+    """
+    max_tokens, overlap_tokens, count_tokens = _budget(max_tokens, overlap_tokens, count_tokens)
+    # Text from absolute offset `base` onwards; everything before it is done
+    state = {"buffer": "", "base": 0}
+
+    def units():
+        pos = 0
+        for piece in pieces:
+            if not piece:
+                continue
+            state["buffer"] += piece
+            buffer, base = state["buffer"], state["base"]
+            spans, next_pos = _sentence_spans(buffer, pos - base, len(buffer), final=False, base=base)
+            pos = next_pos + base
+            yield from _units(buffer, spans, max_tokens, count_tokens, base)
+        buffer, base = state["buffer"], state["base"]
+        spans, _ = _sentence_spans(buffer, pos - base, len(buffer), final=True, base=base)
+        yield from _units(buffer, spans, max_tokens, count_tokens, base)
+
+    for start, end in _pack(units(), max_tokens, overlap_tokens):
+        buffer, base = state["buffer"], state["base"]
+        yield buffer[start - base:end - base]
+        # Later chunks start at or after this one (overlap comes from it)
+        state["buffer"] = buffer[start - base:]
+        state["base"] = start
+
+
+def chunk_text(text, max_tokens=None, overlap_tokens=None, count_tokens=None):
+    """Chunk strings of `text`; see chunk_spans"""
+    return [text[s:e] for s, e in chunk_spans(text, max_tokens, overlap_tokens, count_tokens)]
@@ -0,0 +1,244 @@
+# chatbot/rag/embedding_server.py
+
+"""
+Local embedding service.
+
+One process (`manage.py run_embedding_server`) owns the model and listens on a
+Unix socket; web workers talk to it through EmbeddingClient, which has the same
+encode() interface as SentenceTransformer. Concurrent requests are gathered into
+micro-batches: the batcher takes the first waiting request, then keeps adding
+requests until it has `max_batch` texts or `max_wait_ms` has passed, and runs a
+single forward pass for all of them.
+
+Wire format (both directions): a 4-byte big-endian length followed by a JSON
+header; responses to "encode" are followed by the float32 rows as raw bytes.
+"""
+
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+_LENGTH = struct.Struct("!I")
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding server connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _send_frame(sock, header, payload=b""):
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(data)) + data + payload)
+
+
+def _recv_header(sock):
+    (size,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return json.loads(_recv_exact(sock, size))
+
+
+# ----------------------------------------------------------------------
+# Server
+# ----------------------------------------------------------------------
+class MicroBatcher:
+    """Runs queued encode requests through the model in shared batches"""
+
+    def __init__(self, model, max_batch=64, max_wait_ms=5.0, batch_size=32):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.texts = 0
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def submit(self, texts):
+        """Future resolving to the (len(texts), dim) float32 embeddings"""
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def _gather(self):
+        requests = [self._queue.get()]
+        count = len(requests[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            requests.append(request)
+            count += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._gather()
+            texts = [text for batch, _ in requests for text in batch]
+            try:
+                embeddings = np.asarray(
+                    self.model.encode(
+                        texts,
+                        batch_size=self.batch_size,
+                        show_progress_bar=False,
+                        convert_to_numpy=True,
+                    ),
+                    dtype=np.float32,
+                )
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for batch, future in requests:
+                future.set_result(embeddings[start:start + len(batch)])
+                start += len(batch)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                header = _recv_header(self.request)
+            except (ConnectionError, OSError):
+                return
+            op = header.get("op")
+            try:
+                if op == "encode":
+                    embeddings = server.batcher.submit(header["texts"]).result()
+                    _send_frame(self.request, {"shape": list(embeddings.shape)}, embeddings.tobytes())
+                elif op == "count_tokens":
+                    _send_frame(self.request, {"counts": server.count_tokens(header["texts"])})
+                elif op == "info":
+                    _send_frame(self.request, server.info())
+                else:
+                    _send_frame(self.request, {"error": f"unknown op {op!r}"})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                _send_frame(self.request, {"error": str(e)})
+
+
+class EmbeddingServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Every worker thread holds a connection; allow bursts of connects
+    request_queue_size = 128
+
+    def __init__(self, socket_path, model, max_batch=64, max_wait_ms=5.0, batch_size=32):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # stale socket from a previous run
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+        self.model = model
+        self.batcher = MicroBatcher(model, max_batch=max_batch, max_wait_ms=max_wait_ms, batch_size=batch_size)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+    def count_tokens(self, texts):
+        if hasattr(self.model, "count_tokens"):
+            return self.model.count_tokens(texts)
+        encoded = self.model.tokenizer(
+            list(texts), add_special_tokens=False, return_attention_mask=False, return_token_type_ids=False
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def info(self):
+        return {
+            "max_seq_length": getattr(self.model, "max_seq_length", None),
+            "batches": self.batcher.batches,
+            "texts": self.batcher.texts,
+        }
+
+
+# ----------------------------------------------------------------------
+# Client
+# ----------------------------------------------------------------------
+class EmbeddingClient:
+    """
+    SentenceTransformer-compatible stand-in that forwards to the embedding
+    server. Each thread keeps its own persistent connection.
+    """
+
+    def __init__(self, socket_path, timeout=60.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        info = self._call({"op": "info"})
+        self.max_seq_length = info.get("max_seq_length")
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Blocking connect: a timeout socket gets EAGAIN on a full Unix backlog
+        sock.connect(self.socket_path)
+        sock.settimeout(self.timeout)
+        return sock
+
+    def _call(self, header):
+        """Send one request; reconnects once if the connection was refused, reset or closed"""
+        for attempt in (1, 2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                _send_frame(sock, header)
+                response = _recv_header(sock)
+                if "error" in response:
+                    raise RuntimeError(f"embedding server error: {response['error']}")
+                if "shape" in response:
+                    rows, dim = response["shape"]
+                    payload = _recv_exact(sock, rows * dim * 4)
+                    return np.frombuffer(payload, dtype=np.float32).reshape(rows, dim)
+                return response
+            except (ConnectionError, FileNotFoundError):
+                # Stale pooled connection or restarting server: the request
+                # was not answered, so it is safe to send once more
+                self._discard(sock)
+                if attempt == 2:
+                    raise
+            except OSError:
+                # Timed out (or failed) mid-request: the server may still be
+                # working on it, so fail now instead of sending it again. The
+                # connection could still deliver the late reply; drop it.
+                self._discard(sock)
+                raise
+
+    def _discard(self, sock):
+        if sock is not None:
+            sock.close()
+        self._local.sock = None
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        embeddings = self._call({"op": "encode", "texts": texts})
+        return embeddings[0] if single else embeddings
+
+    def count_tokens(self, texts):
+        return self._call({"op": "count_tokens", "texts": list(texts)})["counts"]
@@ -1,33 +1,233 @@
 # chatbotapp/rag/embeddings.py
 
-from typing import List
+import json
+import threading
+import time
+from pathlib import Path
 
-_model = None  # lazy-loaded
+import numpy as np
+from django.conf import settings
 
+# Default model; settings.EMBEDDING_MODEL_NAME may name another one or a local path
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Local model cache shipped in the Docker image (see download_model.py)
+MODEL_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / "model_cache"
+# int8 ONNX export written by download_model.py
+ONNX_EXPORT_DIR = MODEL_CACHE_DIR / f"onnx-{MODEL_NAME}"
+ONNX_MODEL_FILE = "model-int8.onnx"
+ONNX_EXPORT_INFO = "export.json"
 
-def get_model():
+# Process-wide model registry (see get_model)
+_model = None
+_model_lock = threading.Lock()
+
+
+class OnnxEmbedder:
     """
-    Lazy-load SentenceTransformer model.
-    Loads only when called, not at Django startup.
+    Runs the int8-quantized ONNX export of the sentence-transformers model
+    through onnxruntime. Mirrors the parts of SentenceTransformer the app uses
+    (encode, max_seq_length) without importing torch.
     """
-    global _model
-    if _model is None:
+
+    def __init__(self, export_dir, threads=0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        export_dir = Path(export_dir)
+        with open(export_dir / ONNX_EXPORT_INFO, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        if info.get("pooling") != "mean":
+            raise ValueError(f"Unsupported pooling in ONNX export: {info.get('pooling')}")
+        self.max_seq_length = info["max_seq_length"]
+        self.normalize = info.get("normalize", True)
+
+        # One tokenizer pads/truncates model inputs, the other counts tokens
+        self._tokenizer = Tokenizer.from_file(str(export_dir / "tokenizer.json"))
+        self._tokenizer.enable_truncation(self.max_seq_length)
+        self._tokenizer.enable_padding(pad_id=info["pad_id"], pad_token=info["pad_token"])
+        self._counter = Tokenizer.from_file(str(export_dir / "tokenizer.json"))
+        self._counter.no_truncation()
+        self._counter.no_padding()
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            str(export_dir / ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = {i.name for i in self._session.get_inputs()}
+
+    def count_tokens(self, texts):
+        """Word-piece count of each text, without special tokens"""
+        return [len(e.ids) for e in self._counter.encode_batch(list(texts), add_special_tokens=False)]
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        """Mean-pooled (and L2-normalised) float32 embeddings; a 1-D array for a single string"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encoded = self._tokenizer.encode_batch(texts[start:start + batch_size])
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feeds = {
+                "input_ids": np.array([e.ids for e in encoded], dtype=np.int64),
+                "attention_mask": mask,
+                "token_type_ids": np.array([e.type_ids for e in encoded], dtype=np.int64),
+            }
+            hidden = self._session.run(None, {k: v for k, v in feeds.items() if k in self._inputs})[0]
+            weights = mask[:, :, None].astype(np.float32)
+            pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype(np.float32))
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+class _ServerModel:
+    """
+    Wraps the EmbeddingClient so that web workers keep embedding if the
+    embedding server dies: entrypoint.sh starts it once and does not restart
+    it. When a request still cannot connect after the client's own retry,
+    the model is loaded in-process (as without a server) and used from then on.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._fallback = None
+        self._fallback_lock = threading.Lock()
+        self.max_seq_length = client.max_seq_length
+
+    def _in_process_model(self, error):
+        with self._fallback_lock:
+            if self._fallback is None:
+                print(f"⚠️ Embedding server at {self._client.socket_path} went away ({error}); "
+                      "loading the model in-process")
+                self._fallback = load_embedding_model(use_server=False)
+        return self._fallback
+
+    def _call(self, method, *args, **kwargs):
+        if self._fallback is None:
+            try:
+                return getattr(self._client, method)(*args, **kwargs)
+            except (ConnectionError, FileNotFoundError) as e:
+                self._in_process_model(e)
+        return getattr(self._fallback, method)(*args, **kwargs)
+
+    def encode(self, sentences, *args, **kwargs):
+        return self._call("encode", sentences, *args, **kwargs)
+
+    def count_tokens(self, texts):
+        if self._fallback is None or hasattr(self._fallback, "count_tokens"):
+            return self._call("count_tokens", texts)
+        # SentenceTransformer has no count_tokens; count with its tokenizer
+        encoded = self._fallback.tokenizer(
+            list(texts),
+            add_special_tokens=False,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+def load_embedding_model(backend=None, use_server=True):
+    """
+    Build the embedding backend from settings.EMBEDDING_BACKEND: "torch"
+    (SentenceTransformer) or "onnx" (int8 ONNX export, falls back to torch if
+    the export or onnxruntime is missing). Raises if no backend can load.
+    With settings.EMBEDDING_SERVER_SOCKET set, a client for the local
+    embedding server is returned instead and no model is loaded here unless
+    the server stops answering (see _ServerModel).
+    """
+    socket_path = getattr(settings, "EMBEDDING_SERVER_SOCKET", "")
+    if use_server and socket_path:
+        from .embedding_server import EmbeddingClient
         try:
-            from sentence_transformers import SentenceTransformer
-            _model = SentenceTransformer("all-MiniLM-L6-v2")
+            client = EmbeddingClient(socket_path)
+            print(f"🔌 Using embedding server at {socket_path}")
+            return _ServerModel(client)
+        except OSError as e:
+            print(f"⚠️ Embedding server at {socket_path} unavailable ({e}); loading the model in-process")
+
+    model_name = getattr(settings, "EMBEDDING_MODEL_NAME", "") or MODEL_NAME
+    backend = (backend or getattr(settings, "EMBEDDING_BACKEND", "torch")).lower()
+    if backend == "onnx":
+        export_dir = getattr(settings, "EMBEDDING_ONNX_DIR", None) or MODEL_CACHE_DIR / f"onnx-{Path(model_name).name}"
+        try:
+            print(f"🔄 Loading ONNX embedding model from {export_dir}...")
+            return OnnxEmbedder(export_dir, threads=getattr(settings, "EMBEDDING_ONNX_THREADS", 0))
         except Exception as e:
-            print("⚠️ Embedding model not available:", e)
-            _model = None
-    return _model
+            print(f"⚠️ ONNX embedding backend unavailable ({e}); falling back to torch")
+    elif backend != "torch":
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    from sentence_transformers import SentenceTransformer
+    device = getattr(settings, "EMBEDDING_DEVICE", "") or None  # None: let torch pick
+    print(f"🔄 Loading SentenceTransformer {model_name} (cache {MODEL_CACHE_DIR})...")
+    return SentenceTransformer(model_name, cache_folder=str(MODEL_CACHE_DIR), device=device)
+
+
+def _rss_mb():
+    """Peak resident memory of this process in MB, or None where unsupported"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_model(use_server=True):
+    """
+    The process-wide embedding model, loaded on first use (not at Django
+    startup). Every caller shares this one instance; threads arriving while
+    it loads wait for it instead of loading a copy of their own.
+    `use_server` only matters for the call that loads it (see
+    load_embedding_model). Returns None if no backend could load; the next
+    call tries again.
+    """
+    global _model
+    model = _model
+    if model is None:
+        with _model_lock:
+            model = _model
+            if model is None:
+                rss_before = _rss_mb()
+                started = time.perf_counter()
+                try:
+                    model = load_embedding_model(use_server=use_server)
+                except Exception as e:
+                    print("⚠️ Embedding model not available:", e)
+                    return None
+                message = f"✅ Embedding model ready ({type(model).__name__}) in {time.perf_counter() - started:.1f}s"
+                if rss_before is not None:
+                    message += f", peak RSS +{_rss_mb() - rss_before:.0f} MB"
+                print(message)
+                _model = model
+    return model
+
+
+def warmup(use_server=True):
+    """Load the model and run one encode so the first request pays for neither"""
+    model = get_model(use_server=use_server)
+    if model is not None:
+        started = time.perf_counter()
+        model.encode(["warm up"], show_progress_bar=False)
+        print(f"🔥 Embedding model warmed up in {time.perf_counter() - started:.2f}s")
+    return model
 
 
-def embed_texts(texts: List[str]) -> List[List[float]]:
+def embed_texts(texts):
+    """(len(texts), dim) float32 embeddings; an empty array if no model is available"""
     model = get_model()
     if model is None:
-        return []  # Safe fallback (Replit-safe)
+        return np.empty((0, 0), dtype=np.float32)  # Safe fallback (Replit-safe)
 
-    return model.encode(
-        texts,
-        show_progress_bar=False,
-        convert_to_numpy=True
-    ).tolist()
+    return np.asarray(
+        model.encode(
+            texts,
+            show_progress_bar=False,
+            convert_to_numpy=True
+        ),
+        dtype=np.float32,
+    )
@@ -0,0 +1,417 @@
+# chatbot/rag/indexes.py
+
+"""
+Pluggable search backends for SimpleVectorStore.
+
+The store owns the embedding matrix (rows are L2-normalised, so inner product
+equals cosine similarity) and hands each new batch of rows to its index. An
+index answers `search(matrix, query, top_k, candidates)` with row positions and
+scores, best first. `candidates` is an optional array of allowed rows coming
+from the store's document/user metadata index.
+
+An index is part of the store's published snapshot, so it is never modified
+once searches may be using it: reset(), rebuild() and add() return the index
+for the next snapshot and leave the current one as it was. rebuild() is
+given the segment generation of the rows (see persistence.py) so a
+persisted index is only reused for the rows it was built from.
+
+Backends (settings.VECTOR_INDEX_BACKEND):
+    numpy       exact brute force on the matrix (default, no extra dependency)
+    faiss_flat  exact faiss IndexFlatIP
+    faiss_ivf   faiss IndexIVFFlat, trained once enough rows exist
+    faiss_hnsw  faiss IndexHNSWFlat
+    float16     float16 codes scored first, best candidates rescored exactly
+    int8        the same with per-dimension int8 codes (see quantization.py)
+"""
+
+import copy
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .quantization import BLOCK_ROWS, create_quantizer
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+def top_k_indices(scores, top_k):
+    """
+    Indices of the `top_k` highest scores, best first.
+    Uses a partial selection instead of sorting every score; ties keep
+    insertion order, matching the previous stable full sort.
+    """
+    n = len(scores)
+    if top_k <= 0 or n == 0:
+        return []
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        # Pull in every row tied with the k-th score so ties resolve by index
+        cutoff = scores[candidates].min()
+        candidates = np.flatnonzero(scores >= cutoff)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:top_k].tolist()
+
+
+def exact_search(matrix, query, top_k, candidates=None):
+    """Brute-force inner product over all rows, or only over `candidates`"""
+    if candidates is None:
+        # One mat-vec product gives the cosine similarity of every row
+        scores = matrix @ query
+        rows = top_k_indices(scores, top_k)
+        return rows, [float(scores[row]) for row in rows]
+
+    # Sorted so ties still break by insertion order
+    candidates = np.sort(candidates)
+    if len(candidates) > len(matrix) // 2:
+        # Most rows qualify (e.g. all but deleted ones): scoring every row
+        # is cheaper than copying the candidate rows out of the matrix
+        scores = (matrix @ query)[candidates]
+    else:
+        scores = matrix[candidates] @ query
+    top = top_k_indices(scores, top_k)
+    return [int(candidates[i]) for i in top], [float(scores[i]) for i in top]
+
+
+def merge_results(*results, top_k):
+    """Combine (rows, scores) lists from disjoint row ranges into one top_k ranking"""
+    hits = sorted(
+        ((score, row) for rows, scores in results for row, score in zip(rows, scores)),
+        key=lambda hit: (-hit[0], hit[1]),
+    )[:top_k]
+    return [row for _, row in hits], [score for score, _ in hits]
+
+
+class NumpyIndex:
+    """Exact search straight off the store's matrix; keeps no state of its own"""
+
+    name = "numpy"
+
+    def reset(self):
+        return self
+
+    def rebuild(self, matrix, generation=None):
+        return self
+
+    def add(self, vectors, matrix):
+        return self
+
+    def search(self, matrix, query, top_k, candidates=None):
+        return exact_search(matrix, query, top_k, candidates)
+
+
+def _write_atomically(path, write):
+    """Call write(tmp_path) for a temp file private to this process, then rename it to `path`"""
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+class FaissIndex:
+    """
+    faiss-backed index whose ids are the store's row positions.
+
+    The faiss index covers the first `index.ntotal` rows and is frozen once
+    published; rows appended after it (the tail) are scored exactly from the
+    matrix. When the tail reaches `merge_rows`, add() returns a new FaissIndex
+    over a clone with the tail added, so concurrent searches on the old
+    snapshot never see a faiss index change under them.
+
+    Filtered searches over a small candidate set are answered exactly from the
+    matrix (cheaper and exact); larger ones go through faiss with an
+    IDSelectorBatch so only allowed rows are returned.
+    """
+
+    def __init__(self, kind, persist_dir=None, options=None):
+        if faiss is None:
+            raise ImportError("faiss is not installed")
+        self.kind = kind
+        self.name = f"faiss_{kind}"
+        self.options = options or {}
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self.index = None
+        # Segment generation the rows belong to; recorded with the saved index
+        self.generation = None
+
+    # ------------------------------------------------------------------
+    # Construction
+    # ------------------------------------------------------------------
+    def _new_index(self, dim, train_rows=None):
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.options.get("hnsw_m", 32), faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = self.options.get("hnsw_ef_construction", 80)
+            index.hnsw.efSearch = self.options.get("hnsw_ef_search", 64)
+            return index
+        if self.kind == "ivf":
+            nlist = self.options.get("ivf_nlist", 256)
+            # IVF needs roughly 39 points per centroid to train; stay flat until then
+            if train_rows is not None and len(train_rows) >= 39 * nlist:
+                quantizer = faiss.IndexFlatIP(dim)
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+                index.train(np.ascontiguousarray(train_rows, dtype=np.float32))
+                index.nprobe = self.options.get("ivf_nprobe", 16)
+                return index
+        return faiss.IndexFlatIP(dim)
+
+    def _needs_training(self, index, rows):
+        """True for the flat placeholder of an IVF index once `rows` rows can train it"""
+        return (
+            self.kind == "ivf"
+            and not isinstance(index, faiss.IndexIVFFlat)
+            and rows >= 39 * self.options.get("ivf_nlist", 256)
+        )
+
+    def _with(self, index):
+        """A FaissIndex like this one wrapping `index`"""
+        other = copy.copy(self)
+        other.index = index
+        return other
+
+    @property
+    def indexed_rows(self):
+        return 0 if self.index is None else int(self.index.ntotal)
+
+    def reset(self):
+        return self._with(None)
+
+    def rebuild(self, matrix, generation=None):
+        """
+        Index `matrix`: the persisted index plus whatever rows it is missing if
+        there is one for this generation, otherwise a new index built from scratch.
+        """
+        base = self._with(None)
+        base.generation = generation
+        if len(matrix) == 0:
+            return base
+        index = base._load(len(matrix))
+        if index is None or base._needs_training(index, len(matrix)):
+            return base._build(matrix)
+        rebuilt = base._with(index)
+        if index.ntotal < len(matrix):
+            rebuilt._add_in_batches(matrix[index.ntotal:])
+            rebuilt._save()
+        return rebuilt
+
+    def _build(self, matrix):
+        print(f"🏗️ Building {self.name} index over {len(matrix)} rows...")
+        built = self._with(self._new_index(matrix.shape[1], train_rows=matrix))
+        built._add_in_batches(matrix)
+        built._save()
+        return built
+
+    def _add_in_batches(self, matrix, batch=65536):
+        for start in range(0, len(matrix), batch):
+            self.index.add(np.ascontiguousarray(matrix[start:start + batch], dtype=np.float32))
+
+    def add(self, vectors, matrix):
+        """
+        Account for rows just appended to the store; `matrix` is the full
+        matrix after the append. Small tails stay unindexed (searched exactly).
+        """
+        if len(matrix) - self.indexed_rows < self.options.get("merge_rows", 4096):
+            return self
+        # Switch a flat placeholder to a trained IVF once there is enough data
+        if self.index is None or self._needs_training(self.index, len(matrix)):
+            return self._build(matrix)
+        merged = self._with(faiss.clone_index(self.index))
+        merged._add_in_batches(matrix[self.indexed_rows:])
+        merged._save()
+        return merged
+
+    # ------------------------------------------------------------------
+    # Persistence (flat indexes are rebuilt from the memmap, no file needed)
+    # ------------------------------------------------------------------
+    def _paths(self):
+        base = self.persist_dir / f"index-{self.kind}"
+        return Path(f"{base}.faiss"), Path(f"{base}.json")
+
+    def _save(self):
+        if self.persist_dir is None or self.kind == "flat" or self.index is None:
+            return
+        # Every worker may save (no storage lock is held here), so each file is
+        # written under a temp name private to this process and renamed into
+        # place. _load rejects an index whose row count disagrees with the info
+        # file, which is what interleaved saves from two workers would leave.
+        try:
+            index_path, info_path = self._paths()
+            _write_atomically(index_path, lambda path: faiss.write_index(self.index, str(path)))
+            info = json.dumps({"rows": int(self.index.ntotal), "generation": self.generation})
+            _write_atomically(info_path, lambda path: path.write_text(info, encoding="utf-8"))
+        except Exception as e:
+            print(f"⚠️ Error saving {self.name} index: {e}")
+
+    def _load(self, rows):
+        """The persisted index if it covers at most `rows` rows (the rest are added after), else None"""
+        if self.persist_dir is None or self.kind == "flat":
+            return None
+        index_path, info_path = self._paths()
+        try:
+            with open(info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            saved_rows = info.get("rows")
+            # Indexes saved before compaction existed all belong to segment 1
+            if info.get("generation", 1) != self.generation:
+                return None
+            if not isinstance(saved_rows, int) or saved_rows > rows:
+                return None
+            index = faiss.read_index(str(index_path))
+        except (OSError, ValueError, RuntimeError):
+            return None
+        if index.ntotal != saved_rows:
+            return None
+        if self.kind == "ivf" and isinstance(index, faiss.IndexIVFFlat):
+            index.nprobe = self.options.get("ivf_nprobe", 16)
+        elif self.kind == "hnsw":
+            index.hnsw.efSearch = self.options.get("hnsw_ef_search", 64)
+        print(f"✅ Loaded {self.name} index ({saved_rows} of {rows} rows) from {index_path}")
+        return index
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+    def _search_params(self, selector):
+        if isinstance(self.index, faiss.IndexIVFFlat):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=self.index.nprobe)
+        if isinstance(self.index, faiss.IndexHNSWFlat):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, matrix, query, top_k, candidates=None):
+        indexed = self.indexed_rows
+        if indexed == 0:
+            return exact_search(matrix, query, top_k, candidates)
+        if candidates is not None and len(candidates) <= self.options.get("brute_force_max", 20000):
+            return exact_search(matrix, query, top_k, candidates)
+
+        # Rows past the faiss index are scored exactly and merged in
+        if candidates is None:
+            tail_rows, tail_scores = exact_search(matrix[indexed:], query, top_k)
+            tail = ([row + indexed for row in tail_rows], tail_scores)
+        else:
+            candidates = np.asarray(candidates, dtype=np.int64)
+            tail = exact_search(matrix, query, top_k, candidates[candidates >= indexed])
+            candidates = candidates[candidates < indexed]
+
+        if candidates is not None and len(candidates) == 0:
+            return tail
+        query = np.ascontiguousarray(query.reshape(1, -1), dtype=np.float32)
+        params = None
+        if candidates is not None:
+            params = self._search_params(faiss.IDSelectorBatch(candidates))
+        scores, ids = self.index.search(query, top_k, params=params)
+        hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+        return merge_results(([i for i, _ in hits], [s for _, s in hits]), tail, top_k=top_k)
+
+
+class QuantizedIndex:
+    """
+    Two-pass search over scalar-quantized rows: the codes of every allowed row
+    are scored to shortlist the `rerank_candidates` best (at least 2 * top_k),
+    and only those rows are rescored exactly from the float32 matrix.
+
+    Codes take 2 (float16) or 1 (int8) bytes per dimension instead of 4, and a
+    search reads just the shortlisted rows of the matrix, so a memory-mapped
+    matrix is not pulled into memory by every query.
+
+    Codes live in a growable buffer shared by successive indexes; add() only
+    writes past the rows published indexes look at. int8 scales are refitted
+    (and every row re-encoded) each time the store has doubled since the last
+    fit, so early rows do not fix the range for good.
+    """
+
+    def __init__(self, quantization, options=None):
+        self.name = quantization
+        self.options = options or {}
+        self.quantizer = create_quantizer(quantization)
+        self.codes = None
+        self.fitted_rows = 0
+        self._buffer = None
+
+    def _with(self, quantizer, buffer, rows, fitted_rows):
+        """A QuantizedIndex like this one over the first `rows` codes of `buffer`"""
+        other = copy.copy(self)
+        other.quantizer = quantizer
+        other._buffer = buffer
+        other.fitted_rows = fitted_rows
+        if buffer is None:
+            other.codes = None
+        else:
+            other.codes = buffer[:rows].view()
+            other.codes.setflags(write=False)
+        return other
+
+    @property
+    def indexed_rows(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    def reset(self):
+        return self._with(self.quantizer, None, 0, 0)
+
+    def rebuild(self, matrix, generation=None):
+        """Fit the quantizer to `matrix` and encode every row"""
+        if len(matrix) == 0:
+            return self.reset()
+        quantizer = self.quantizer.fit(matrix)
+        buffer = np.empty(matrix.shape, dtype=quantizer.dtype)
+        for start in range(0, len(matrix), BLOCK_ROWS):
+            buffer[start:start + BLOCK_ROWS] = quantizer.encode(matrix[start:start + BLOCK_ROWS])
+        return self._with(quantizer, buffer, len(matrix), len(matrix))
+
+    def add(self, vectors, matrix):
+        """Encode the rows just appended; `matrix` is the full matrix after the append"""
+        start, needed = self.indexed_rows, len(matrix)
+        if (
+            self.codes is None
+            or start != needed - len(vectors)
+            or (self.quantizer.needs_fit and needed >= 2 * self.fitted_rows)
+        ):
+            return self.rebuild(matrix)
+        buffer = self._buffer
+        if len(buffer) < needed:
+            grown = np.empty((max(needed, 2 * len(buffer)), buffer.shape[1]), dtype=buffer.dtype)
+            grown[:start] = buffer[:start]
+            buffer = grown
+        buffer[start:needed] = self.quantizer.encode(vectors)
+        return self._with(self.quantizer, buffer, needed, self.fitted_rows)
+
+    def search(self, matrix, query, top_k, candidates=None):
+        depth = max(2 * top_k, self.options.get("rerank_candidates", 100))
+        if candidates is None:
+            if len(matrix) <= depth or self.indexed_rows != len(matrix):
+                return exact_search(matrix, query, top_k)
+            scores = self.quantizer.scores(self.codes, query)
+            shortlist = np.asarray(top_k_indices(scores, depth), dtype=np.int64)
+        else:
+            candidates = np.asarray(candidates, dtype=np.int64)
+            if len(candidates) <= depth or self.indexed_rows != len(matrix):
+                return exact_search(matrix, query, top_k, candidates)
+            if len(candidates) > len(matrix) // 2:
+                scores = self.quantizer.scores(self.codes, query)[candidates]
+            else:
+                scores = self.quantizer.scores(self.codes[candidates], query)
+            shortlist = candidates[top_k_indices(scores, depth)]
+        return exact_search(matrix, query, top_k, shortlist)
+
+
+def create_index(backend, persist_dir=None, options=None):
+    """Build the configured index backend, falling back to numpy if faiss is unavailable"""
+    backend = (backend or "numpy").lower()
+    if backend == "numpy":
+        return NumpyIndex()
+    if backend in ("float16", "int8"):
+        return QuantizedIndex(backend, options=options)
+    if backend.startswith("faiss_") and backend[len("faiss_"):] in ("flat", "ivf", "hnsw"):
+        if faiss is None:
+            print(f"⚠️ VECTOR_INDEX_BACKEND={backend} but faiss is not installed; using numpy")
+            return NumpyIndex()
+        return FaissIndex(backend[len("faiss_"):], persist_dir=persist_dir, options=options)
+    raise ValueError(f"Unknown vector index backend: {backend}")
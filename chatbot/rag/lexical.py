@@ -0,0 +1,265 @@
+# chatbot/rag/lexical.py
+
+"""
+Keyword (BM25) retrieval over the vector store's rows, and the reciprocal
+rank fusion that combines it with the dense ranking.
+
+Dense embeddings match meaning but blur exact identifiers, codes and names
+("ERR-4012", "invoice 88231"); BM25 matches those tokens exactly. The index
+is an inverted index from term to compact postings arrays (row positions and
+term frequencies), kept up to date as rows are appended.
+
+Like the search indexes in indexes.py, a BM25Index belongs to the store's
+published snapshot and is never modified once published: add() returns the
+index for the next snapshot. Postings live in append-only buffers shared by
+successive indexes, and each index only looks at the prefix it was built
+with, so appends cost the new rows, not the corpus.
+
+to_arrays() / from_arrays() convert an index to and from flat CSR arrays,
+which the store persists next to each segment (see persistence.py) so a
+process opening the segment maps the postings instead of re-tokenizing every
+row. compacted() derives those arrays for the store after compaction.
+"""
+
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+# Words, plus identifiers joined by - . / : _ (e.g. "err-4012", "v2.3.1")
+TOKEN = re.compile(r"\w+(?:[-./:]\w+)*")
+PART = re.compile(r"[^\W_]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the "
+    "this to was were what when where which who will with".split()
+)
+
+
+def tokenize(text):
+    """Lowercased terms of `text`; compound identifiers also yield their parts"""
+    terms = []
+    for match in TOKEN.finditer(text.lower()):
+        token = match.group()
+        if token not in STOPWORDS:
+            terms.append(token)
+        parts = PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+
+def _grow(array, needed):
+    """Return `array` with room for at least `needed` items, doubling capacity"""
+    if len(array) >= needed:
+        return array
+    grown = np.empty(max(needed, 2 * len(array), 8), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _frozen(array):
+    view = array.view()
+    view.setflags(write=False)
+    return view
+
+
+EMPTY_ROWS = _frozen(np.empty(0, dtype=np.int32))
+EMPTY_TFS = _frozen(np.empty(0, dtype=np.uint16))
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the store's rows. `postings` maps each term to read-only
+    (rows, term frequencies) arrays in row order; `lengths` holds each row's
+    term count.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.lengths = _frozen(np.empty(0, dtype=np.float32))
+        self.total_length = 0
+        # Writer-side growable buffers: term -> [rows, tfs, used], and row lengths
+        self._buffers = {}
+        self._lengths = np.empty(0, dtype=np.float32)
+
+    @property
+    def rows(self):
+        return len(self.lengths)
+
+    def reset(self):
+        return BM25Index(self.k1, self.b)
+
+    def to_arrays(self):
+        """
+        The index as CSR arrays: `terms`, `offsets` (term i's postings are
+        [offsets[i], offsets[i + 1])), `rows`, `tfs` and row `lengths`.
+        """
+        terms = list(self.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows, _ in self.postings.values()], out=offsets[1:])
+        postings = list(self.postings.values())
+        return {
+            "terms": terms,
+            "offsets": offsets,
+            "rows": np.concatenate([rows for rows, _ in postings]) if postings else EMPTY_ROWS,
+            "tfs": np.concatenate([tfs for _, tfs in postings]) if postings else EMPTY_TFS,
+            "lengths": np.asarray(self.lengths),
+        }
+
+    def from_arrays(self, arrays):
+        """
+        A BM25Index with this one's parameters over CSR arrays (see to_arrays).
+        Postings are views into the arrays, so memory-mapped arrays stay on disk
+        until searched; a term's postings are copied only when rows are added to it.
+        """
+        other = self.reset()
+        rows, tfs = arrays["rows"], arrays["tfs"]
+        bounds = np.asarray(arrays["offsets"]).tolist()
+        other.postings = {
+            term: (_frozen(rows[start:end]), _frozen(tfs[start:end]))
+            for term, start, end in zip(arrays["terms"], bounds, bounds[1:])
+        }
+        other._lengths = arrays["lengths"]
+        other.lengths = _frozen(other._lengths)
+        other.total_length = int(np.sum(other._lengths, dtype=np.float64))
+        return other
+
+    def compacted(self, deleted):
+        """
+        CSR arrays (see to_arrays) of this index without the rows flagged in
+        `deleted`, renumbered the way compaction renumbers the store's rows.
+        """
+        arrays = self.to_arrays()
+        keep = ~np.asarray(deleted[:self.rows], dtype=bool)
+        renumber = np.cumsum(keep, dtype=np.int64) - 1
+        live = keep[arrays["rows"]]
+        offsets = arrays["offsets"]
+        # Every term has at least one posting, so no reduceat segment is empty
+        counts = np.add.reduceat(live.astype(np.int64), offsets[:-1]) if len(live) else offsets[1:]
+        kept = counts > 0
+        new_offsets = np.zeros(int(kept.sum()) + 1, dtype=np.int64)
+        np.cumsum(counts[kept], out=new_offsets[1:])
+        return {
+            "terms": [term for term, k in zip(arrays["terms"], kept.tolist()) if k],
+            "offsets": new_offsets,
+            "rows": renumber[arrays["rows"][live]].astype(np.int32),
+            "tfs": arrays["tfs"][live],
+            "lengths": arrays["lengths"][keep],
+        }
+
+    def add(self, texts, start):
+        """
+        A BM25Index that also covers `texts`, the rows from `start` on.
+        start=0 builds a fresh index over `texts`.
+        """
+        base = self if start else self.reset()
+        if start != base.rows:
+            raise ValueError(f"BM25 index has {base.rows} rows, cannot append at row {start}")
+        other = BM25Index(self.k1, self.b)
+        other._buffers = base._buffers
+        other._lengths = _grow(base._lengths, start + len(texts))
+        other.postings = dict(base.postings)
+        other.total_length = base.total_length
+
+        new_postings = {}
+        for offset, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            row = start + offset
+            length = sum(counts.values())
+            other._lengths[row] = length
+            other.total_length += length
+            for term, tf in counts.items():
+                entry = new_postings.get(term)
+                if entry is None:
+                    new_postings[term] = entry = ([], [])
+                entry[0].append(row)
+                entry[1].append(min(tf, 65535))
+
+        for term, (rows, tfs) in new_postings.items():
+            buffer = other._buffers.get(term)
+            if buffer is None:
+                # Start from the term's postings (views into from_arrays() input), copied on growth
+                old_rows, old_tfs = other.postings.get(term, (EMPTY_ROWS, EMPTY_TFS))
+                buffer = other._buffers[term] = [old_rows, old_tfs, len(old_rows)]
+            used = buffer[2]
+            needed = used + len(rows)
+            # Rows past `used` are free: published indexes only view [:used]
+            buffer[0] = _grow(buffer[0], needed)
+            buffer[1] = _grow(buffer[1], needed)
+            buffer[0][used:needed] = rows
+            buffer[1][used:needed] = tfs
+            buffer[2] = needed
+            other.postings[term] = (_frozen(buffer[0][:needed]), _frozen(buffer[1][:needed]))
+        other.lengths = _frozen(other._lengths[:start + len(texts)])
+        return other
+
+    def search(self, query, top_k, candidates=None, deleted=None):
+        """
+        Rows and BM25 scores of the `top_k` best matches, optionally only among
+        `candidates`. `deleted` flags tombstoned rows: they are left out of the
+        collection statistics (row count, document frequencies, average
+        length) as well as the results, so deleted documents do not skew the
+        scores of live ones before compaction removes them.
+        """
+        n = self.rows
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self.postings]
+        if not terms or n == 0 or top_k <= 0:
+            return [], []
+        live_rows, live_length = n, self.total_length
+        if deleted is not None:
+            deleted = np.asarray(deleted[:n], dtype=bool)
+            live_rows -= int(np.count_nonzero(deleted))
+            live_length -= float(self.lengths[deleted].sum())
+            if live_rows == 0:
+                return [], []
+        avg_length = live_length / live_rows if live_length > 0 else 1.0
+        allowed = None
+        if candidates is not None:
+            allowed = np.zeros(n, dtype=bool)
+            allowed[np.asarray(candidates, dtype=np.int64)] = True
+
+        rows_parts, score_parts = [], []
+        for term in terms:
+            rows, tfs = self.postings[term]
+            if deleted is not None:
+                live = ~deleted[rows]
+                rows, tfs = rows[live], tfs[live]
+            df = len(rows)
+            if not df:
+                continue
+            idf = math.log(1.0 + (live_rows - df + 0.5) / (df + 0.5))
+            if allowed is not None:
+                keep = allowed[rows]
+                rows, tfs = rows[keep], tfs[keep]
+                if not len(rows):
+                    continue
+            tfs = tfs.astype(np.float32)
+            norm = self.k1 * (1.0 - self.b + self.b * self.lengths[rows] / avg_length)
+            rows_parts.append(rows)
+            score_parts.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+        if not rows_parts:
+            return [], []
+
+        rows, inverse = np.unique(np.concatenate(rows_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        # Highest score first, ties by row
+        order = np.lexsort((rows, -scores))[:top_k]
+        return rows[order].tolist(), scores[order].tolist()
+
+
+def reciprocal_rank_fusion(rankings, top_k, k=60):
+    """
+    Fuse ranked row lists: each row scores sum(1 / (k + rank)) over the
+    rankings it appears in (rank from 1). Rows tied on the fused score keep
+    the order in which the rankings first listed them.
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    best = sorted(fused.items(), key=lambda item: -item[1])[:top_k]
+    return [row for row, _ in best], [score for _, score in best]
@@ -1,12 +1,96 @@
 # chatbotapp/rag/loader.py
 
+import codecs
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
 from PyPDF2 import PdfReader
 from docx import Document as DocxDocument
 
+# TXT files are decoded in blocks of this many bytes
+TEXT_BLOCK_BYTES = 1 << 20
 
-def load_document(uploaded_file):
+
+# In each pool worker process: the reader of the PDF the pool was started for
+_worker_reader = None
+
+
+def _open_worker_reader(path):
+    """Process-pool initializer: parse the PDF's xref and page tree once per worker, not per task"""
+    global _worker_reader
+    _worker_reader = PdfReader(path)
+
+
+def _extract_page_range(start, end):
+    """Process-pool task: text of pages [start, end) of the worker's PDF"""
+    pages = _worker_reader.pages
+    return [pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def _local_path(uploaded_file):
+    """Filesystem path of the upload if it has one (worker processes reopen it)"""
+    try:
+        path = uploaded_file.path
+    except (AttributeError, NotImplementedError, ValueError):
+        return None
+    return path if path and os.path.exists(path) else None
+
+
+def _iter_pdf_pages(uploaded_file, progress_callback=None):
+    reader = PdfReader(uploaded_file)
+    total = len(reader.pages)
+    workers = getattr(settings, "LOADER_PROCESSES", 1)
+    path = _local_path(uploaded_file)
+
+    if workers <= 1 or path is None or total < getattr(settings, "LOADER_PARALLEL_MIN_PAGES", 64):
+        for i, page in enumerate(reader.pages):
+            yield page.extract_text() or ""
+            if progress_callback:
+                progress_callback(i + 1, total)
+        return
+
+    # Large PDF: workers extract page ranges; results are yielded in page
+    # order with only a few ranges in flight, so memory stays bounded.
+    # "spawn" because ingestion runs on threads, which fork does not copy safely.
+    step = getattr(settings, "LOADER_PAGES_PER_TASK", 16)
+    ranges = iter([(s, min(s + step, total)) for s in range(0, total, step)])
+    print(f"📄 Extracting {total} PDF pages with {workers} processes...")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_open_worker_reader,
+        initargs=(path,),
+    ) as pool:
+        pending = deque()
+
+        def submit_next():
+            span = next(ranges, None)
+            if span is not None:
+                pending.append(pool.submit(_extract_page_range, *span))
+
+        for _ in range(2 * workers):
+            submit_next()
+        done = 0
+        while pending:
+            pages = pending.popleft().result()
+            submit_next()
+            for text in pages:
+                yield text
+            done += len(pages)
+            if progress_callback:
+                progress_callback(done, total)
+
+
+def iter_document_text(uploaded_file, progress_callback=None):
     """
-    Load text from PDF, DOCX, or TXT
+    Yield the text of a PDF, DOCX or TXT upload incrementally (PDF pages,
+    DOCX paragraphs, TXT blocks) so it can be chunked while it is still being
+    extracted. Pieces are yielded with their separators: concatenating them
+    gives the full text. `progress_callback(done, total)` reports extraction
+    progress in pages, paragraphs or bytes.
     """
 
     filename = uploaded_file.name.lower()
@@ -15,24 +99,43 @@ def load_document(uploaded_file):
     # PDF
     # ==========================
     if filename.endswith(".pdf"):
-        reader = PdfReader(uploaded_file)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text.strip()
+        for text in _iter_pdf_pages(uploaded_file, progress_callback):
+            yield text + "\n"
 
     # ==========================
     # DOCX
     # ==========================
     elif filename.endswith(".docx"):
         doc = DocxDocument(uploaded_file)
-        return "\n".join(p.text for p in doc.paragraphs).strip()
+        paragraphs = doc.paragraphs
+        for i, p in enumerate(paragraphs):
+            yield p.text + "\n"
+            if progress_callback:
+                progress_callback(i + 1, len(paragraphs))
 
     # ==========================
     # TXT
     # ==========================
     elif filename.endswith(".txt"):
-        return uploaded_file.read().decode("utf-8", errors="ignore").strip()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        total = getattr(uploaded_file, "size", 0) or 0
+        done = 0
+        while True:
+            block = uploaded_file.read(TEXT_BLOCK_BYTES)
+            if not block:
+                break
+            yield decoder.decode(block)
+            done += len(block)
+            if progress_callback and total:
+                progress_callback(min(done, total), total)
+        yield decoder.decode(b"", final=True)
 
     else:
-        raise ValueError("Unsupported file type") 
\ No newline at end of file
+        raise ValueError("Unsupported file type")
+
+
+def load_document(uploaded_file):
+    """
+    Load text from PDF, DOCX, or TXT
+    """
+    return "".join(iter_document_text(uploaded_file)).strip()
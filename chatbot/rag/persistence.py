@@ -0,0 +1,388 @@
+# chatbot/rag/persistence.py
+
+"""
+Append-only on-disk format for SimpleVectorStore.
+
+A store directory holds one active segment made of raw, append-only files:
+
+    seg-000001.f32    float32 embedding rows (rows x dim), opened with np.memmap
+    seg-000001.txt    UTF-8 chunk texts, back to back
+    seg-000001.off    int64 end offset of each row's text in the .txt file
+    seg-000001.meta   int64 metadata columns per row (document_id, user_id, chunk, filename_id)
+    seg-000001.names  JSON-encoded filenames, one per line (filename_id = line number)
+    seg-000001.bm25   BM25 postings over the segment's first rows (optional, see below)
+    manifest.json     committed sizes of the files above
+
+Writers append to the segment files, fsync them, then atomically replace the
+manifest. Readers only look at the byte ranges the manifest commits to, so a
+crash mid-append leaves garbage past the committed end that the next writer
+truncates, never a corrupt store.
+
+Every worker process maps the same files read-only, so the embedding matrix and
+texts live once in the OS page cache however many workers there are. Writers
+take an exclusive flock, so there is one writer at a time; readers notice new
+commits through the manifest's "version" (see SimpleVectorStore.refresh).
+
+Deleting documents never touches the segment files: their ids are added to
+the manifest's "deleted" list (tombstones) and readers skip their rows.
+Compaction later copies the live rows into the next segment (seg-000002.*,
+...) and commits a manifest pointing at it. The tombstones stay: a document
+deleted while it was still being ingested can have chunks appended after the
+compaction, and they must stay hidden too.
+Segments two generations old are removed then; the previous one is kept for
+readers that may still be opening it from the manifest they last read.
+
+The .bm25 file caches the keyword index (lexical.py) so opening a segment
+maps its postings instead of re-tokenizing every text. It is a cache, not
+part of the commit: it is written whole and renamed into place, covers the
+first "rows" rows of its segment (the rest are tokenized on open) and is
+simply rebuilt if missing or unreadable.
+"""
+
+import contextlib
+import json
+import mmap
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
+
+FORMAT_VERSION = 1
+META_COLUMNS = 4  # document_id, user_id, chunk, filename_id
+MANIFEST = "manifest.json"
+LOCK_FILE = ".lock"
+SEGMENT_FILE = re.compile(r"seg-(\d+)\.\w+$")
+# Arrays of a .bm25 file, in file order, between its JSON header and the terms
+POSTINGS_ARRAYS = (("offsets", np.int64), ("lengths", np.float32), ("rows", np.int32), ("tfs", np.uint16))
+
+
+class MappedTexts:
+    """Read-only sequence of strings decoded lazily from a memory-mapped blob"""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __bool__(self):
+        return len(self._offsets) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.raw(index).decode("utf-8")
+
+    def raw(self, index):
+        """UTF-8 bytes of one text"""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("text index out of range")
+        start = int(self._offsets[index - 1]) if index else 0
+        end = int(self._offsets[index])
+        return self._blob[start:end]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class SegmentStorage:
+    """Reads and appends the segment files of one store directory"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    # ------------------------------------------------------------------
+    # Paths / manifest
+    # ------------------------------------------------------------------
+    def _path(self, segment, suffix):
+        return self.root / f"seg-{segment:06d}.{suffix}"
+
+    def read_manifest(self):
+        """Committed manifest dict, or None for an empty directory"""
+        try:
+            with open(self.root / MANIFEST, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector store format: {manifest.get('format')}")
+        return manifest
+
+    def manifest_token(self):
+        """
+        Cheap change marker for the manifest. Every commit replaces the file by
+        rename, so its inode/mtime/size change; None while there is no manifest.
+        """
+        try:
+            st = os.stat(self.root / MANIFEST)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _write_manifest(self, manifest):
+        """Atomically replace the manifest (write, fsync, rename)"""
+        tmp_path = self.root / (MANIFEST + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.root / MANIFEST)
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(self.root, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Exclusive cross-process lock for writers"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / LOCK_FILE, "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def _map_array(self, path, dtype, shape):
+        if shape[0] == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    def _map_blob(self, path, size):
+        if size == 0:
+            return b""
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    def open_view(self, manifest):
+        """
+        Map the committed part of the active segment. Returns a dict with the
+        embedding matrix, lazily-decoded texts, metadata columns and filenames.
+        """
+        segment, rows, dim = manifest["segment"], manifest["rows"], manifest["dim"]
+        offsets = self._map_array(self._path(segment, "off"), np.int64, (rows,))
+        meta = self._map_array(self._path(segment, "meta"), np.int64, (rows, META_COLUMNS))
+        with open(self._path(segment, "names"), "rb") as f:
+            raw_names = f.read(manifest["names_bytes"])
+        return {
+            "matrix": self._map_array(self._path(segment, "f32"), np.float32, (rows, dim)),
+            "texts": MappedTexts(self._map_blob(self._path(segment, "txt"), manifest["text_bytes"]), offsets),
+            "meta": meta,
+            "filenames": [json.loads(line) for line in raw_names.splitlines()],
+        }
+
+    def read_postings(self, segment):
+        """
+        Memory-mapped BM25 arrays (see BM25Index.from_arrays) saved for
+        `segment`, or None if there are none. Their "lengths" give the rows covered.
+        """
+        path = self._path(segment, "bm25")
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            header_size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_size))
+            if header.get("format") != FORMAT_VERSION:
+                return None
+            arrays = {}
+            position = 8 + header_size
+            for name, dtype in POSTINGS_ARRAYS:
+                length = header[name]
+                # Plain ndarray views of the map: slicing np.memmap objects is slow
+                arrays[name] = (
+                    np.asarray(np.memmap(path, dtype=dtype, mode="r", offset=position, shape=(length,)))
+                    if length else np.empty(0, dtype=dtype)
+                )
+                position += length * np.dtype(dtype).itemsize
+            f.seek(position)
+            terms_blob = f.read(header["terms_bytes"])
+        arrays["terms"] = terms_blob.decode("utf-8").split("\n") if terms_blob else []
+        return arrays
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def write_postings(self, segment, arrays):
+        """
+        Save BM25 arrays (see BM25Index.to_arrays) for `segment`. Written to a
+        temporary file and renamed, so it needs no lock and readers never see
+        half a file; processes that save the same segment write equivalent data.
+        """
+        terms_blob = "\n".join(arrays["terms"]).encode("utf-8")
+        header = {"format": FORMAT_VERSION, "terms_bytes": len(terms_blob)}
+        header.update({name: len(arrays[name]) for name, _ in POSTINGS_ARRAYS})
+        header_bytes = json.dumps(header).encode("utf-8")
+        # Pad so the arrays (widest first) start 8-byte aligned
+        header_bytes += b" " * (-len(header_bytes) % 8)
+        path = self._path(segment, "bm25")
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for name, dtype in POSTINGS_ARRAYS:
+                f.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+            f.write(terms_blob)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _committed_sizes(self, manifest):
+        rows = manifest["rows"]
+        return {
+            "f32": rows * manifest["dim"] * 4,
+            "txt": manifest["text_bytes"],
+            "off": rows * 8,
+            "meta": rows * META_COLUMNS * 8,
+            "names": manifest["names_bytes"],
+        }
+
+    def _append_bytes(self, path, committed, payload):
+        """Drop anything past the committed size (a crashed append), then append"""
+        with open(path, "a+b") as f:
+            f.truncate(committed)
+            f.seek(committed)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def append(self, vectors, texts, doc_ids, user_ids, ordinals, filenames):
+        """
+        Append rows to the active segment and commit them.
+        Must be called while holding `lock()`. Returns (manifest_before, manifest_after).
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        before = self.read_manifest()
+        if before is None:
+            before = {
+                "format": FORMAT_VERSION,
+                "segment": 1,
+                "dim": int(vectors.shape[1]),
+                "rows": 0,
+                "text_bytes": 0,
+                "names_bytes": 0,
+                "version": 0,
+            }
+        if before["dim"] != vectors.shape[1]:
+            raise ValueError(f"Embedding dim {vectors.shape[1]} does not match store dim {before['dim']}")
+
+        segment = before["segment"]
+        committed = self._committed_sizes(before)
+
+        # Filenames are interned per segment; ids are assigned under the lock
+        with open(self._path(segment, "names"), "a+b") as f:
+            f.seek(0)
+            known = [json.loads(line) for line in f.read(committed["names"]).splitlines()]
+        name_ids = {name: i for i, name in enumerate(known)}
+        new_names = []
+        filename_ids = []
+        for name in filenames:
+            if name not in name_ids:
+                name_ids[name] = len(name_ids)
+                new_names.append(name)
+            filename_ids.append(name_ids[name])
+        names_payload = "".join(json.dumps(name) + "\n" for name in new_names).encode("utf-8")
+
+        encoded = [t.encode("utf-8") for t in texts]
+        ends = before["text_bytes"] + np.cumsum([len(b) for b in encoded], dtype=np.int64)
+        meta = np.column_stack([
+            np.asarray(doc_ids, dtype=np.int64),
+            np.asarray(user_ids, dtype=np.int64),
+            np.asarray(ordinals, dtype=np.int64),
+            np.asarray(filename_ids, dtype=np.int64),
+        ])
+
+        self._append_bytes(self._path(segment, "f32"), committed["f32"], vectors.tobytes())
+        self._append_bytes(self._path(segment, "txt"), committed["txt"], b"".join(encoded))
+        self._append_bytes(self._path(segment, "off"), committed["off"], ends.tobytes())
+        self._append_bytes(self._path(segment, "meta"), committed["meta"], meta.tobytes())
+        self._append_bytes(self._path(segment, "names"), committed["names"], names_payload)
+
+        after = dict(before)
+        after["rows"] = before["rows"] + len(vectors)
+        after["text_bytes"] = int(ends[-1]) if len(ends) else before["text_bytes"]
+        after["names_bytes"] = before["names_bytes"] + len(names_payload)
+        after["version"] = before["version"] + 1
+        self._write_manifest(after)
+        return before, after
+
+    def delete_documents(self, document_ids):
+        """
+        Tombstone documents: commit a manifest listing them as deleted.
+        Must be called while holding `lock()`. Returns the manifest after.
+        """
+        before = self.read_manifest()
+        if before is None:
+            return None
+        deleted = set(before.get("deleted", [])) | {int(d_id) for d_id in document_ids}
+        after = dict(before)
+        after["deleted"] = sorted(deleted)
+        after["version"] = before["version"] + 1
+        self._write_manifest(after)
+        return after
+
+    def compact(self, manifest, rows, batch=4096):
+        """
+        Copy `rows` (the live rows, ascending) of the committed segment into the
+        next segment and commit it, keeping the tombstones (see above). Must be
+        called while holding `lock()`. Returns the manifest after.
+        """
+        view = self.open_view(manifest)
+        segment = manifest["segment"] + 1
+        suffixes = ("f32", "txt", "off", "meta")
+        files = {suffix: open(self._path(segment, suffix), "wb") for suffix in suffixes}
+        text_bytes = 0
+        try:
+            for start in range(0, len(rows), batch):
+                part = np.asarray(rows[start:start + batch], dtype=np.int64)
+                encoded = [view["texts"].raw(row) for row in part.tolist()]
+                ends = text_bytes + np.cumsum([len(b) for b in encoded], dtype=np.int64)
+                text_bytes = int(ends[-1])
+                files["f32"].write(np.ascontiguousarray(view["matrix"][part], dtype=np.float32).tobytes())
+                files["txt"].write(b"".join(encoded))
+                files["off"].write(ends.tobytes())
+                files["meta"].write(np.ascontiguousarray(view["meta"][part], dtype=np.int64).tobytes())
+            for f in files.values():
+                f.flush()
+                os.fsync(f.fileno())
+        finally:
+            for f in files.values():
+                f.close()
+        # Filename ids are kept as they are, so the names table is copied whole
+        with open(self._path(manifest["segment"], "names"), "rb") as f:
+            names = f.read(manifest["names_bytes"])
+        with open(self._path(segment, "names"), "wb") as f:
+            f.write(names)
+            f.flush()
+            os.fsync(f.fileno())
+
+        after = dict(manifest)
+        after["segment"] = segment
+        after["rows"] = len(rows)
+        after["text_bytes"] = text_bytes
+        after["version"] = manifest["version"] + 1
+        self._write_manifest(after)
+
+        for path in self.root.iterdir():
+            match = SEGMENT_FILE.match(path.name)
+            if match and int(match.group(1)) < manifest["segment"]:
+                path.unlink(missing_ok=True)
+        return after
@@ -0,0 +1,86 @@
+# chatbot/rag/quantization.py
+
+"""
+Scalar quantization of the embedding matrix for the coarse pass of a search.
+
+A quantizer turns float32 rows into compact codes and scores a query against
+codes without decoding them in full:
+
+    float16   2 bytes per dimension; scores within ~1e-3 of float32, but
+              numpy converts float16 slowly, so the coarse pass costs CPU
+    int8      1 byte per dimension; each dimension is scaled by its own
+              range (max |value| over the rows it was fitted on)
+
+Codes only rank candidates. QuantizedIndex (indexes.py) rescores the best of
+them exactly from the float32 matrix, so the final order and scores are the
+same as an exact search whenever the true top rows survive the coarse pass.
+"""
+
+import numpy as np
+
+# Rows converted to float32 at a time while fitting, encoding or scoring:
+# bounds the scratch memory and keeps each block in cache for the product
+BLOCK_ROWS = 256
+
+
+def _block_scores(codes, query):
+    """codes @ query, decoding `BLOCK_ROWS` rows to float32 at a time"""
+    scores = np.empty(len(codes), dtype=np.float32)
+    for start in range(0, len(codes), BLOCK_ROWS):
+        block = codes[start:start + BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query
+    return scores
+
+
+class Float16Quantizer:
+    name = "float16"
+    dtype = np.float16
+    # Codes do not depend on the other rows, so there is nothing to refit
+    needs_fit = False
+
+    def fit(self, rows):
+        return self
+
+    def encode(self, rows):
+        return np.asarray(rows, dtype=np.float32).astype(np.float16)
+
+    def scores(self, codes, query):
+        return _block_scores(codes, np.asarray(query, dtype=np.float32))
+
+
+class Int8Quantizer:
+    """Symmetric per-dimension int8: value ~= code * scale[dim]"""
+
+    name = "int8"
+    dtype = np.int8
+    needs_fit = True
+
+    def __init__(self, scale=None):
+        self.scale = scale
+
+    def fit(self, rows):
+        """A quantizer whose per-dimension scales cover `rows`"""
+        peak = np.zeros(rows.shape[1], dtype=np.float32)
+        for start in range(0, len(rows), BLOCK_ROWS):
+            np.maximum(peak, np.abs(rows[start:start + BLOCK_ROWS]).max(axis=0), out=peak)
+        peak[peak == 0] = 1.0
+        return Int8Quantizer((peak / 127.0).astype(np.float32))
+
+    def encode(self, rows):
+        # Values outside the fitted range saturate; the exact rerank corrects for it
+        codes = np.rint(np.asarray(rows, dtype=np.float32) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def scores(self, codes, query):
+        # sum(code * scale * q) == codes @ (scale * q): fold the scales into the query
+        return _block_scores(codes, self.scale * np.asarray(query, dtype=np.float32))
+
+
+QUANTIZERS = {"float16": Float16Quantizer, "int8": Int8Quantizer}
+
+
+def create_quantizer(name):
+    try:
+        return QUANTIZERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown quantization: {name}") from None
@@ -1,50 +1,203 @@
 # chatbot/rag/rag_pipeline.py
 
-from .loader import load_document
-from .vectorstore import initialize_vectorstore, chunk_text
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .chunking import chunk_text, iter_chunks
+from .loader import iter_document_text
+from .vectorstore import initialize_vectorstore
 
 # Initialize vector store on import
 GLOBAL_VECTOR_STORE = initialize_vectorstore()
 
+# Documents whose ingestion had finished when this process last synced them
+_COMPLETE_DOCUMENTS = set()
+
+
+# ======================================================
+# 💾 CHUNK PERSISTENCE (DocumentChunk rows)
+# ======================================================
+def document_filename(doc):
+    return doc.file.name.split('/')[-1] if doc.file.name else f"doc_{doc.id}"
+
+
+class DocumentMetadataCache:
+    """
+    Request-scoped Document lookups for a set of ids: one bulk query on first
+    use, with extracted_text deferred. Django fetches the text of a document
+    only if something reads it (embed_document_text re-chunking a document
+    that has no stored chunks).
+    """
+
+    def __init__(self, document_ids):
+        self.document_ids = list(document_ids)
+        self._documents = None
+
+    def load(self):
+        """Run the query now (e.g. before handing the cache to a thread without DB access)"""
+        if self._documents is None:
+            from ..models import Document
+            self._documents = Document.objects.defer("extracted_text").in_bulk(self.document_ids)
+        return self
+
+    def get(self, document_id):
+        return self.load()._documents.get(document_id)
+
+
+def store_document_chunks(document_id, user_id, filename, chunks, batch_size=None, first_ordinal=0):
+    """
+    Embed chunks once, add them to the vector store and save them with their
+    embeddings as DocumentChunk rows so later reloads skip the model entirely.
+    `first_ordinal` is the position of chunks[0] within the document.
+    Returns the number of chunks stored; raises Document.DoesNotExist if the
+    document no longer exists.
+    """
+    from ..models import Document, DocumentChunk
+
+    started = time.perf_counter()
+    embeddings = GLOBAL_VECTOR_STORE.encode_texts(chunks, batch_size=batch_size)
+    if embeddings is None:
+        return 0
+    # The document may have been deleted while this group was embedding
+    if not Document.objects.filter(id=document_id).exists():
+        raise Document.DoesNotExist(f"Document {document_id} was deleted during ingestion")
+
+    added = GLOBAL_VECTOR_STORE.add_embeddings(
+        chunks,
+        embeddings,
+        metadata=[
+            {"document_id": document_id, "user_id": user_id, "filename": filename, "chunk": i}
+            for i in range(first_ordinal, first_ordinal + len(chunks))
+        ],
+    )
+    DocumentChunk.objects.bulk_create(
+        [
+            DocumentChunk(
+                document_id=document_id,
+                ordinal=i,
+                content=chunk,
+                embedding=DocumentChunk.pack_embedding(vector),
+            )
+            for i, (chunk, vector) in enumerate(zip(chunks, embeddings), start=first_ordinal)
+        ],
+        batch_size=500,
+        # A stalled worker whose job was reclaimed may still be writing the same chunks
+        ignore_conflicts=True,
+    )
+    elapsed = time.perf_counter() - started
+    rate = added / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Stored {added} chunks for document {document_id} ({rate:.1f} chunks/sec)")
+    return added
+
+
+def load_document_chunks(doc, batch_size=None, embed_text=True):
+    """
+    Load a document into the vector store from its saved DocumentChunk rows,
+    with zero model inference. Only chunks past those already in the store are
+    fetched (from one past the highest stored ordinal), so a document still
+    being ingested can be topped up repeatedly.
+    Ready documents ingested before chunks were saved fall back to
+    embed_document_text() unless `embed_text` is False.
+    Returns the number of chunks loaded.
+    """
+    from ..models import DocumentChunk
+
+    fname = document_filename(doc)
+    loaded = GLOBAL_VECTOR_STORE.next_ordinal(doc.id)
+    rows = list(
+        DocumentChunk.objects.filter(document_id=doc.id, ordinal__gte=loaded)
+        .order_by("ordinal")
+        .values_list("ordinal", "content", "embedding")
+    )
+    if rows:
+        vectors = np.stack([DocumentChunk.unpack_embedding(raw) for _, _, raw in rows])
+        return GLOBAL_VECTOR_STORE.add_embeddings(
+            [content for _, content, _ in rows],
+            vectors,
+            metadata=[
+                {"document_id": doc.id, "user_id": doc.user_id, "filename": fname, "chunk": ordinal}
+                for ordinal, _, _ in rows
+            ],
+        )
+
+    if embed_text and loaded == 0:
+        return embed_document_text(doc, batch_size=batch_size)
+    return 0
+
+
+def embed_document_text(doc, batch_size=None):
+    """
+    Re-chunk and embed the extracted_text of a ready document that has no
+    stored chunks (ingested before chunks were saved), which also backfills
+    the rows. Returns the number of chunks stored.
+    """
+    from ..models import Document
+
+    if doc.status != Document.STATUS_READY or not doc.extracted_text:
+        return 0
+    fname = document_filename(doc)
+    print(f"📦 No stored chunks for {fname}; embedding extracted text once...")
+    count_tokens, max_tokens = GLOBAL_VECTOR_STORE.token_budget()
+    chunks = chunk_text(doc.extracted_text, max_tokens=max_tokens, count_tokens=count_tokens)
+    return store_document_chunks(doc.id, doc.user_id, fname, chunks, batch_size=batch_size)
+
 
 # ======================================================
 # 📄 INGEST DOCUMENT (PDF / DOCX / TXT)
 # ======================================================
-def ingest_document(user, uploaded_file, document_id):
+def ingest_document(user, uploaded_file, document_id, progress_callback=None):
     """
-    Store document chunks with document_id embedded into text.
-    Persists extracted text to DB for auto-reload.
+    Store document chunks tagged with document_id/filename metadata.
+    Persists extracted text and chunk embeddings to DB for auto-reload.
+    Text is chunked while it is still being extracted, and chunks are
+    committed in groups so they become searchable while the rest of the
+    document is still embedding; `progress_callback(done, total)` is called
+    after each group with the extraction progress. Returns the number of
+    chunks ingested.
     """
+    fname = uploaded_file.name.split('/')[-1]
+    group = getattr(settings, "INGESTION_COMMIT_CHUNKS", 64)
+
+    extracted = []
+    progress = [0, 0]
+
+    def track(done, total):
+        progress[:] = [done, total]
 
-    text = load_document(uploaded_file)
+    def pieces():
+        for piece in iter_document_text(uploaded_file, progress_callback=track):
+            extracted.append(piece)
+            yield piece
 
-    if not text or not text.strip():
+    added = 0
+    ordinal = 0
+    batch = []
+    count_tokens, max_tokens = GLOBAL_VECTOR_STORE.token_budget()
+    for chunk in iter_chunks(pieces(), max_tokens=max_tokens, count_tokens=count_tokens):
+        batch.append(chunk)
+        if len(batch) == group:
+            added += store_document_chunks(document_id, user.id, fname, batch, first_ordinal=ordinal)
+            ordinal += len(batch)
+            batch = []
+            if progress_callback:
+                progress_callback(*progress)
+    if batch:
+        added += store_document_chunks(document_id, user.id, fname, batch, first_ordinal=ordinal)
+        ordinal += len(batch)
+
+    if ordinal == 0:
         print("❌ No text extracted")
-        return
+        return 0
 
     # ✅ SAVE TO DATABASE (for persistence across restarts)
     from ..models import Document
-    Document.objects.filter(id=document_id).update(extracted_text=text)
+    Document.objects.filter(id=document_id).update(extracted_text="".join(extracted).strip())
 
-    chunks = chunk_text(text)
+    print(f"✅ Ingested {added} chunks for document {document_id}")
+    return added
 
-    # 🔑 Embed document_id and FILENAME into the text itself
-    fname = uploaded_file.name
-    wrapped_chunks = [
-        f"[DOCUMENT_ID={document_id} FILENAME={fname}]\n{chunk}"
-        for chunk in chunks
-    ]
-
-    GLOBAL_VECTOR_STORE.add_texts(
-        texts=wrapped_chunks,
-        metadata={
-            "user_id": user.id,
-            "filename": fname,
-        }
-    )
-
-    print(f"✅ Ingested {len(chunks)} chunks for document {document_id}")
-    
 
 # ======================================================
 # 🔍 RETRIEVE CONTEXT (SUPPORT MULTI-DOC + AUTO-RELOAD)
@@ -58,31 +211,69 @@ def retrieve_context(question, document_ids=None, top_k=3):
     """
     if not document_ids:
         return []
+    documents, unembedded = prepare_retrieval(document_ids)
+    return search_context(question, document_ids, documents, unembedded, top_k=top_k)
 
+
+def prepare_retrieval(document_ids):
+    """
+    The database half of retrieve_context(): load the documents' metadata and
+    any of their stored chunks this worker is missing. Returns the loaded
+    DocumentMetadataCache and the ready documents that have no stored chunks
+    at all, which search_context() embeds (see embed_document_text).
+    """
     from ..models import Document
-    
+
+    # Map rows other workers committed to the shared segment files
+    GLOBAL_VECTOR_STORE.refresh()
+
+    documents = DocumentMetadataCache(document_ids).load()
+    unembedded = []
+
     # 🔄 ROBUST AUTO-RELOAD (Fix for Render/Multi-worker)
-    # Get all text markers currently in this process's memory
-    currently_loaded_markers = "".join([t.split(']\n', 1)[0] for t in GLOBAL_VECTOR_STORE.texts[:500]])
-    
+    # Documents still being ingested are topped up with whatever chunks are ready.
     for d_id in document_ids:
-        marker = f"[DOCUMENT_ID={d_id}"
-        # Check if ANY chunk in the global store contains this marker
-        is_already_loaded = any(marker in t for t in GLOBAL_VECTOR_STORE.texts)
-        
-        if not is_already_loaded:
-            print(f"🔍 [Worker Sync] Document {d_id} not in memory. Fetching from DB...")
-            doc = Document.objects.filter(id=d_id).first()
-            if doc and doc.extracted_text:
-                fname = doc.file.name.split('/')[-1] if doc.file.name else f"doc_{d_id}"
-                print(f"📦 [Worker Sync] Loading {fname} ({len(doc.extracted_text)} chars) into vector store...")
-                chunks = chunk_text(doc.extracted_text)
-                wrapped = [f"[DOCUMENT_ID={d_id} FILENAME={fname}]\n{c}" for c in chunks]
-                GLOBAL_VECTOR_STORE.add_texts(wrapped)
-            else:
-                print(f"⚠️ [Worker Sync] Document {d_id} cannot be loaded: No text available in DB.")
-        else:
-            print(f"✅ [Worker Sync] Document {d_id} is already in memory.")
+        if d_id in _COMPLETE_DOCUMENTS:
+            continue
+        doc = documents.get(d_id)
+        if not doc:
+            print(f"⚠️ [Worker Sync] Document {d_id} no longer exists.")
+            continue
+        added = load_document_chunks(doc, embed_text=False)
+        if added:
+            print(f"📦 [Worker Sync] Loaded {added} chunks of {document_filename(doc)} into vector store")
+        if doc.status == Document.STATUS_READY and GLOBAL_VECTOR_STORE.next_ordinal(d_id) == 0:
+            unembedded.append(doc)
+            continue
+        _track_loaded(doc)
+    return documents, unembedded
+
+
+def _track_loaded(doc):
+    """Remember a ready document once its chunks are in the store, so later requests skip it"""
+    from ..models import Document
+
+    loaded = GLOBAL_VECTOR_STORE.has_document(doc.id)
+    if doc.status == Document.STATUS_READY and loaded:
+        _COMPLETE_DOCUMENTS.add(doc.id)
+    elif doc.status == Document.STATUS_READY:
+        # Nothing could be loaded (no model, embedding error): retry next time
+        print(f"⚠️ [Worker Sync] Document {doc.id} is ready but none of its chunks could be loaded.")
+    elif not loaded:
+        print(f"⏳ [Worker Sync] Document {doc.id} is {doc.status}; no chunks available yet.")
+
+
+def search_context(question, document_ids, documents, unembedded=(), top_k=3):
+    """
+    The model/search half of retrieve_context(), over the documents that
+    prepare_retrieval() returned. It reads the database only to embed
+    `unembedded` documents, a one-off per document.
+    """
+    for doc in unembedded:
+        added = embed_document_text(doc)
+        if added:
+            print(f"📦 [Worker Sync] Loaded {added} chunks of {document_filename(doc)} into vector store")
+        _track_loaded(doc)
 
     # 🎯 INTENT DETECTION
     is_general_query = any(w in question.lower() for w in ["explain", "summarize", "tell me about", "what is this"])
@@ -107,7 +298,7 @@ def retrieve_context(question, document_ids=None, top_k=3):
     
     if target_ids == document_ids:
         for d_id in document_ids:
-            doc = Document.objects.filter(id=d_id).first()
+            doc = documents.get(d_id)
             if doc and doc.file.name.split('/')[-1].lower() in lower_q:
                 target_ids = [d_id]
                 break
@@ -118,27 +309,28 @@ def retrieve_context(question, document_ids=None, top_k=3):
         except ValueError:
             curr_idx = "?"
 
-        relevant_chunks = [t for t in GLOBAL_VECTOR_STORE.texts if f"[DOCUMENT_ID={target_ids[0]}" in t]
+        relevant_chunks = GLOBAL_VECTOR_STORE.get_document_chunks(target_ids[0], limit=3)
         if relevant_chunks:
-            res = []
-            for c in relevant_chunks[:3]:
-                content = c.split("]\n", 1)[-1]
-                res.append(f"[Document {curr_idx}]\n{content}")
-            return res
-
-    # Similarity Search
-    results = GLOBAL_VECTOR_STORE.similarity_search(query=question, top_k=top_k * 5)
+            return [f"[Document {curr_idx}]\n{content}" for content in relevant_chunks]
+
+    # Similarity Search (scores only the chunks of the targeted documents)
+    results = GLOBAL_VECTOR_STORE.similarity_search_with_metadata(
+        query=question, top_k=top_k, document_ids=target_ids
+    )
     if not results: return []
 
-    filtered = []
-    for chunk in results:
-        for idx, d_id in enumerate(document_ids):
-            if f"[DOCUMENT_ID={d_id}" in chunk:
-                if d_id in target_ids:
-                    content = chunk.split("]\n", 1)[-1]
-                    filtered.append(f"[Document {idx+1}]\n{content}")
-                break 
-        if len(filtered) >= top_k:
-            break
-
-    return filtered
+    positions = {d_id: idx for idx, d_id in reversed(list(enumerate(document_ids)))}
+    return [
+        f"[Document {positions[result['document_id']] + 1}]\n{result['text']}"
+        for result in results
+    ]
+
+
+# ======================================================
+# 🗑️ DELETION
+# ======================================================
+def forget_documents(document_ids):
+    """Take deleted documents out of retrieval (see SimpleVectorStore.delete_documents)"""
+    for d_id in document_ids:
+        _COMPLETE_DOCUMENTS.discard(d_id)
+    return GLOBAL_VECTOR_STORE.delete_documents(document_ids)
@@ -1,153 +1,935 @@
-# chatbot/rag/vectorstore.py
-
-import numpy as np
-import os
-import pickle
-from pathlib import Path
-
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:
-    SentenceTransformer = None
-
-
-class SimpleVectorStore:
-    def __init__(self, persist_path=None):
-        self.texts = []
-        self.embeddings = []
-        self.model = None
-        self.persist_path = persist_path
-        if persist_path:
-            self._load_from_disk()
-
-    def _load_model(self):
-        if self.model is None and SentenceTransformer is not None:
-            try:
-                # Use local model cache directory
-                base_dir = Path(__file__).resolve().parent.parent.parent
-                cache_dir = str(base_dir / "model_cache")
-                print(f"🔄 Loading SentenceTransformer from {cache_dir}...")
-                self.model = SentenceTransformer("all-MiniLM-L6-v2", cache_folder=cache_dir)
-            except Exception as e:
-                print(f"⚠️ Error loading SentenceTransformer: {e}")
-                self.model = None
-
-    def _save_to_disk(self):
-        """Save vector store to disk"""
-        if not self.persist_path:
-            return
-        try:
-            data = {
-                'texts': self.texts,
-                'embeddings': self.embeddings
-            }
-            # Ensure directory exists
-            persist_dir = Path(self.persist_path).parent
-            persist_dir.mkdir(parents=True, exist_ok=True)
-            
-            # Save to temporary file first, then rename (atomic write)
-            temp_path = str(self.persist_path) + '.tmp'
-            with open(temp_path, 'wb') as f:
-                pickle.dump(data, f)
-            
-            # Atomic rename
-            if os.path.exists(self.persist_path):
-                os.remove(self.persist_path)
-            os.rename(temp_path, self.persist_path)
-            
-            print(f"💾 Saved {len(self.texts)} chunks to {self.persist_path}")
-        except Exception as e:
-            print(f"⚠️ Error saving vector store: {e}")
-
-    def _load_from_disk(self):
-        """Load vector store from disk"""
-        if not self.persist_path or not os.path.exists(self.persist_path):
-            if self.persist_path:
-                print(f"📂 No existing vector store found at {self.persist_path}, starting fresh")
-            return
-        try:
-            with open(self.persist_path, 'rb') as f:
-                data = pickle.load(f)
-                self.texts = data.get('texts', [])
-                self.embeddings = data.get('embeddings', [])
-                print(f"✅ Loaded {len(self.texts)} chunks from {self.persist_path}")
-        except Exception as e:
-            print(f"⚠️ Error loading vector store from {self.persist_path}: {e}")
-            # Reset to empty on error
-            self.texts = []
-            self.embeddings = []
-
-    def add_texts(self, texts, metadata=None):
-        self._load_model()
-        if self.model is None:
-            print("❌ Cannot add_texts: Model is not loaded. Check if sentence-transformers is installed.")
-            return
-
-        print(f"📝 Vectorizing {len(texts)} new chunks...")
-        try:
-            for text in texts:
-                emb = self.model.encode(text)
-                self.texts.append(text)
-                self.embeddings.append(emb)
-            
-            print(f"✅ Current total chunks in store: {len(self.texts)}")
-            
-            # Auto-save after adding texts
-            if self.persist_path:
-                self._save_to_disk()
-        except Exception as e:
-            print(f"❌ Error adding texts to vector store: {e}")
-
-    def similarity_search(self, query, top_k=3):
-        self._load_model()
-        if not self.texts:
-            print("📭 Vector store is empty. No context to retrieve.")
-            return []
-        if self.model is None:
-            print("❌ Cannot search: Model is not loaded.")
-            return []
-
-        print(f"🔍 Searching context for query: '{query}'...")
-        query_emb = self.model.encode(query)
-        scores = []
-
-        for idx, emb in enumerate(self.embeddings):
-            # Calculate cosine similarity
-            norm_q = np.linalg.norm(query_emb)
-            norm_e = np.linalg.norm(emb)
-            if norm_q > 0 and norm_e > 0:
-                score = np.dot(query_emb, emb) / (norm_q * norm_e)
-            else:
-                score = 0.0
-            scores.append((score, self.texts[idx]))
-
-        scores.sort(reverse=True, key=lambda x: x[0])
-        return [text for _, text in scores[:top_k]]
-
-
-# 🔥 GLOBAL STORE with persistence
-def get_vectorstore_path():
-    """Get the path for the persistent vector store"""
-    # Use a fixed path relative to the project root for reliability
-    base_dir = Path(__file__).resolve().parent.parent.parent
-    vectorstore_dir = base_dir / 'vectorstore_data'
-    vectorstore_dir.mkdir(exist_ok=True)
-    return str(vectorstore_dir / 'vectorstore.pkl')
-
-# Initialize once at module level
-GLOBAL_VECTOR_STORE = SimpleVectorStore(persist_path=get_vectorstore_path())
-
-def initialize_vectorstore():
-    """Returns the global vector store instance"""
-    return GLOBAL_VECTOR_STORE
-
-
-def chunk_text(text, chunk_size=400, overlap=50):
-    words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunks.append(" ".join(words[start:end]))
-        start += chunk_size - overlap
-    return chunks
+# chatbot/rag/vectorstore.py
+
+import numpy as np
+import os
+import pickle
+import re
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+
+from .cache import LRUCache, normalize_query
+from .chunking import estimate_tokens
+from .embeddings import get_model
+from .indexes import create_index
+from .lexical import BM25Index, reciprocal_rank_fusion
+from .persistence import SegmentStorage
+
+# Metadata value stored for rows without a document or user
+NO_ID = -1
+
+# Chunk header written by older versions into the chunk text itself
+LEGACY_MARKER = re.compile(r"^\[DOCUMENT_ID=(\d+) FILENAME=(.*?)\]\n", re.DOTALL)
+
+# Pickle snapshot written by older versions, migrated on first load
+LEGACY_PICKLE = "vectorstore.pkl"
+
+# Rows tokenized while opening a segment past its saved BM25 postings at
+# which the postings are saved again (fewer are cheaper to redo than to write)
+LEXICAL_SAVE_ROWS = 1000
+
+
+def _frozen(array):
+    """Read-only view of `array`"""
+    view = array.view()
+    view.setflags(write=False)
+    return view
+
+
+EMPTY_ROWS = _frozen(np.empty(0, dtype=np.int64))
+
+
+class Snapshot(namedtuple("Snapshot", [
+    "matrix", "texts", "doc_ids", "user_ids", "ordinals", "file_ids",
+    "filenames", "doc_index", "user_index", "index", "lexical",
+    "deleted_docs", "deleted", "live_rows", "version",
+])):
+    """
+    Immutable state of a SimpleVectorStore at one version: the embedding
+    matrix, texts and metadata columns (all aligned by row), the
+    document/user row indexes, the search index built over the matrix and
+    the BM25 index over the texts (None when hybrid search is off).
+
+    Rows of deleted documents stay in place until compaction; `deleted` is
+    their tombstone mask (None when nothing is deleted) and `live_rows` the
+    remaining rows (None when every row is live). Deleted documents are left
+    out of `doc_index`.
+
+    Writers never modify a published snapshot; they build the next one and
+    swap it in with a single attribute assignment. A reader takes
+    `store._snapshot` once and uses only that object, so its texts, rows and
+    scores stay aligned for the whole search without holding a lock.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def empty(cls, index, lexical, version=0):
+        return cls(
+            matrix=_frozen(np.empty((0, 0), dtype=np.float32)),
+            texts=(),
+            doc_ids=EMPTY_ROWS,
+            user_ids=EMPTY_ROWS,
+            ordinals=EMPTY_ROWS,
+            file_ids=EMPTY_ROWS,
+            filenames=(),
+            doc_index={},
+            user_index={},
+            index=index,
+            lexical=lexical,
+            deleted_docs=frozenset(),
+            deleted=None,
+            live_rows=None,
+            version=version,
+        )
+
+    @property
+    def dead_rows(self):
+        """Rows of deleted documents still taking up space"""
+        return 0 if self.live_rows is None else len(self.texts) - len(self.live_rows)
+
+    def metadata(self, row):
+        """Metadata dict for one stored row"""
+        doc_id = int(self.doc_ids[row])
+        user_id = int(self.user_ids[row])
+        return {
+            "document_id": None if doc_id == NO_ID else doc_id,
+            "user_id": None if user_id == NO_ID else user_id,
+            "filename": self.filenames[self.file_ids[row]],
+            "chunk": int(self.ordinals[row]),
+        }
+
+    def document_rows(self, document_id):
+        """Row positions of a document's chunks, in chunk order"""
+        return self.doc_index.get(int(document_id), EMPTY_ROWS)
+
+    def next_ordinal(self, document_id):
+        """One past the highest chunk ordinal stored for a document (0 if none)"""
+        rows = self.document_rows(document_id)
+        return int(self.ordinals[rows].max()) + 1 if len(rows) else 0
+
+    def candidate_rows(self, document_ids=None, user_id=None):
+        """
+        Rows allowed by the filters, looked up through the metadata indexes.
+        Returns None when every row is a candidate (unfiltered, nothing deleted).
+        """
+        if document_ids is None and user_id is None:
+            return self.live_rows
+        rows = None
+        if document_ids is not None:
+            parts = [self.document_rows(d_id) for d_id in dict.fromkeys(document_ids)]
+            rows = np.concatenate(parts) if parts else EMPTY_ROWS
+        if user_id is not None:
+            user_rows = self.user_index.get(int(user_id), EMPTY_ROWS)
+            rows = user_rows if rows is None else rows[self.user_ids[rows] == int(user_id)]
+            if self.deleted is not None:
+                rows = rows[~self.deleted[rows]]
+        return rows
+
+
+class SimpleVectorStore:
+    def __init__(self, persist_path=None):
+        """
+        `persist_path` is a directory holding the append-only segment files
+        (see persistence.py). Without it the store lives purely in memory.
+        The search backend is chosen by settings.VECTOR_INDEX_BACKEND (see indexes.py).
+        """
+        index = create_index(
+            getattr(settings, "VECTOR_INDEX_BACKEND", "numpy"),
+            persist_dir=persist_path,
+            options=getattr(settings, "VECTOR_INDEX_OPTIONS", {}),
+        )
+        # Keyword index fused with the dense ranking (see lexical.py)
+        lexical = None
+        if getattr(settings, "RETRIEVAL_HYBRID", True):
+            lexical = BM25Index(k1=getattr(settings, "BM25_K1", 1.2), b=getattr(settings, "BM25_B", 0.75))
+        # What searches read; replaced (never modified) whenever rows change
+        self._snapshot = Snapshot.empty(index, lexical)
+        self._query_cache = LRUCache(getattr(settings, "RETRIEVAL_QUERY_CACHE_SIZE", 1024))
+        self._result_cache = LRUCache(getattr(settings, "RETRIEVAL_RESULT_CACHE_SIZE", 1024))
+        # Serialises writers (appends and refreshes); readers never take it
+        self._lock = threading.RLock()
+        # Manifest change marker last seen by refresh()
+        self._manifest_token = None
+        # Set while a background compaction runs (see delete_documents)
+        self._compacting = False
+        self._reset()
+        self.model = None
+        self.persist_path = persist_path
+        self._storage = SegmentStorage(persist_path) if persist_path else None
+        if persist_path:
+            self._load_from_disk()
+
+    def _load_model(self):
+        if self.model is None:
+            # The process-wide model shared with embed_texts (None if unavailable)
+            self.model = get_model()
+
+    def token_budget(self):
+        """
+        (count_tokens, max_tokens) for chunking: a batch token counter for the
+        model's tokenizer and how many tokens of a chunk the model embeds.
+        """
+        self._load_model()
+        max_seq_length = getattr(self.model, "max_seq_length", None) or 256
+        max_tokens = getattr(settings, "CHUNK_MAX_TOKENS", 0) or max_seq_length - 2  # [CLS] and [SEP]
+        if hasattr(self.model, "count_tokens"):
+            return self.model.count_tokens, max_tokens
+        tokenizer = getattr(self.model, "tokenizer", None)
+        if tokenizer is None:
+            return estimate_tokens, max_tokens
+
+        def count_tokens(texts):
+            encoded = tokenizer(
+                list(texts),
+                add_special_tokens=False,
+                return_attention_mask=False,
+                return_token_type_ids=False,
+            )
+            return [len(ids) for ids in encoded["input_ids"]]
+
+        return count_tokens, max_tokens
+
+    @property
+    def version(self):
+        """Bumped whenever rows are added or removed; part of every result cache key"""
+        return self._snapshot.version
+
+    @property
+    def texts(self):
+        return self._snapshot.texts
+
+    @property
+    def embeddings(self):
+        """Live rows of the embedding matrix (a read-only view, not a copy)"""
+        return self._snapshot.matrix
+
+    @staticmethod
+    def _normalize(vectors):
+        """Return float32 unit-length rows; zero vectors stay zero"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors.reshape(1, -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    @staticmethod
+    def _grow(array, needed):
+        """
+        Return `array` with room for at least `needed` rows, doubling capacity.
+        Rows are only ever written past the live end, so published snapshots
+        can keep viewing the old buffer.
+        """
+        if len(array) >= needed:
+            return array
+        grown = np.empty((max(needed, 2 * len(array), 64),) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    @staticmethod
+    def _metadata_rows(metadata, count):
+        """Expand `metadata` (one dict for all rows, or a list of dicts) to `count` dicts"""
+        if metadata is None:
+            return [{}] * count
+        if isinstance(metadata, dict):
+            return [metadata] * count
+        metadata = list(metadata)
+        if len(metadata) != count:
+            raise ValueError(f"Expected {count} metadata entries, got {len(metadata)}")
+        return metadata
+
+    def _filename_id(self, filename):
+        file_id = self._filename_lookup.get(filename)
+        if file_id is None:
+            file_id = len(self._filename_table)
+            self._filename_table.append(filename)
+            self._filename_lookup[filename] = file_id
+        return file_id
+
+    def _build_columns(self, metadata, count):
+        """Turn per-row metadata dicts into id/ordinal columns for `count` new rows"""
+        doc_ids = np.empty(count, dtype=np.int64)
+        user_ids = np.empty(count, dtype=np.int64)
+        ordinals = np.empty(count, dtype=np.int64)
+        filenames = []
+        next_ordinal = {}
+        snapshot = self._snapshot
+        for i, meta in enumerate(self._metadata_rows(metadata, count)):
+            doc_id = meta.get("document_id")
+            doc_id = NO_ID if doc_id is None else int(doc_id)
+            user_id = meta.get("user_id")
+            doc_ids[i] = doc_id
+            user_ids[i] = NO_ID if user_id is None else int(user_id)
+            if doc_id == NO_ID:
+                ordinals[i] = meta.get("chunk", 0)
+            else:
+                ordinal = next_ordinal.get(doc_id)
+                if ordinal is None:
+                    ordinal = snapshot.next_ordinal(doc_id)
+                ordinals[i] = meta.get("chunk", ordinal)
+                next_ordinal[doc_id] = ordinal + 1
+            filenames.append(meta.get("filename") or "")
+        return doc_ids, user_ids, ordinals, filenames
+
+    def _new_rows(self, doc_ids, ordinals):
+        """
+        Mask of rows whose (document, chunk ordinal) is not stored yet and
+        does not repeat an earlier row of the same batch
+        """
+        snapshot = self._snapshot
+        keep = np.zeros(len(doc_ids), dtype=bool)
+        _, first = np.unique(np.column_stack((doc_ids, ordinals)), axis=0, return_index=True)
+        keep[first] = True
+        # Rows without a document have no chunk identity to compare
+        keep[doc_ids == NO_ID] = True
+        for doc_id in np.unique(doc_ids).tolist():
+            rows = snapshot.doc_index.get(doc_id)
+            if doc_id == NO_ID or rows is None:
+                continue
+            mask = doc_ids == doc_id
+            keep[mask] &= ~np.isin(ordinals[mask], snapshot.ordinals[rows])
+        return keep
+
+    def _append_columns(self, doc_ids, user_ids, ordinals, file_ids):
+        """Append metadata for rows already present in the matrix"""
+        start = self._meta_size
+        needed = start + len(doc_ids)
+        self._doc_ids = self._grow(self._doc_ids, needed)
+        self._user_ids = self._grow(self._user_ids, needed)
+        self._ordinals = self._grow(self._ordinals, needed)
+        self._file_ids = self._grow(self._file_ids, needed)
+        self._doc_ids[start:needed] = doc_ids
+        self._user_ids[start:needed] = user_ids
+        self._ordinals[start:needed] = ordinals
+        self._file_ids[start:needed] = file_ids
+        self._meta_size = needed
+
+    @staticmethod
+    def _extend_index(index, ids, start):
+        """
+        Copy of `index` (id -> row array) with rows `start`, `start + 1`, ...
+        grouped by `ids`. Arrays of ids that gained no rows are shared with
+        `index`, so the cost follows the new rows, not the store.
+        """
+        index = dict(index)
+        # Group rows by id with one stable sort instead of a per-row loop
+        order = np.argsort(ids, kind="stable")
+        unique, firsts = np.unique(ids[order], return_index=True)
+        for key, group in zip(unique.tolist(), np.split(order + start, firsts[1:])):
+            if key != NO_ID:
+                rows = index.get(key)
+                index[key] = _frozen(group if rows is None else np.concatenate((rows, group)))
+        return index
+
+    def _tombstones(self, previous, doc_ids, start):
+        """(deleted mask, live rows) for the writer's deleted documents, or (None, None)"""
+        deleted_docs = self._deleted_docs
+        if not deleted_docs:
+            return None, None
+        if start and previous.deleted is not None and previous.deleted_docs == deleted_docs:
+            # Same tombstones: only the new rows need checking
+            new = np.isin(doc_ids[start:], np.fromiter(deleted_docs, dtype=np.int64))
+            deleted = np.concatenate((previous.deleted, new))
+        else:
+            deleted = np.isin(doc_ids, np.fromiter(deleted_docs, dtype=np.int64))
+        # Tombstones can name documents with no rows here (deleted before their
+        # chunks arrived): keep the mask for later appends, but every row is live
+        live_rows = _frozen(np.flatnonzero(~deleted)) if deleted.any() else None
+        return _frozen(deleted), live_rows
+
+    def _publish(self, matrix, texts, index, start=0, lexical=None):
+        """
+        Swap in a snapshot of the writer state, whose rows from `start` on are
+        new (start=0 rebuilds the row indexes). `lexical` is a BM25 index
+        already covering `texts`; without it the previous one is extended.
+        Called with the lock held.
+        """
+        previous = self._snapshot
+        size = len(texts)
+        if lexical is None and previous.lexical is not None:
+            lexical = previous.lexical.add(texts[start:], start)
+        doc_ids = _frozen(self._doc_ids[:size])
+        user_ids = _frozen(self._user_ids[:size])
+        doc_index = self._extend_index(previous.doc_index if start else {}, doc_ids[start:], start)
+        for doc_id in self._deleted_docs:
+            doc_index.pop(doc_id, None)
+        deleted, live_rows = self._tombstones(previous, doc_ids, start)
+        self._snapshot = Snapshot(
+            matrix=_frozen(matrix[:size]),
+            texts=texts,
+            doc_ids=doc_ids,
+            user_ids=user_ids,
+            ordinals=_frozen(self._ordinals[:size]),
+            file_ids=_frozen(self._file_ids[:size]),
+            filenames=tuple(self._filename_table),
+            doc_index=doc_index,
+            user_index=self._extend_index(previous.user_index if start else {}, user_ids[start:], start),
+            index=index,
+            lexical=lexical,
+            deleted_docs=self._deleted_docs,
+            deleted=deleted,
+            live_rows=live_rows,
+            version=previous.version + 1,
+        )
+        # Invalidate cached search results now that the set of rows changed
+        self._result_cache.clear()
+
+    def _append_rows(self, vectors, texts, metadata=None):
+        """
+        Append embeddings, texts and metadata as aligned rows (persisted if configured).
+        Chunks whose (document, ordinal) is already stored are skipped, so two
+        workers topping up the same document do not duplicate it.
+        Returns the number of rows added.
+        """
+        vectors = self._normalize(vectors)
+        if len(vectors) == 0:
+            return 0
+        if len(vectors) != len(texts):
+            raise ValueError(f"Got {len(vectors)} embeddings for {len(texts)} texts")
+
+        if self._storage is not None:
+            with self._lock, self._storage.lock():
+                # Catch up with other writers first so ordinals and duplicates
+                # are judged against the latest committed rows
+                self._sync_view(self._storage.read_manifest())
+                columns, vectors, texts = self._dedupe(metadata, vectors, texts)
+                if not texts:
+                    return 0
+                _, after = self._storage.append(vectors, texts, *columns)
+                self._sync_view(after)
+            print(f"💾 Appended {len(vectors)} chunks to {self.persist_path} ({after['rows']} total)")
+            return len(texts)
+
+        with self._lock:
+            (doc_ids, user_ids, ordinals, filenames), vectors, texts = self._dedupe(metadata, vectors, texts)
+            if not texts:
+                return 0
+            start = self._size
+            needed = start + len(vectors)
+            if self._matrix is None:
+                self._matrix = np.empty((0, vectors.shape[1]), dtype=np.float32)
+            self._matrix = self._grow(self._matrix, needed)
+            self._matrix[start:needed] = vectors
+            self._size = needed
+            self._append_columns(doc_ids, user_ids, ordinals, [self._filename_id(name) for name in filenames])
+            matrix = self._matrix[:needed]
+            snapshot = self._snapshot
+            self._publish(matrix, snapshot.texts + tuple(texts), snapshot.index.add(vectors, matrix), start)
+            return len(texts)
+
+    def _dedupe(self, metadata, vectors, texts):
+        """Build metadata columns and drop rows that are already stored"""
+        doc_ids, user_ids, ordinals, filenames = self._build_columns(metadata, len(texts))
+        keep = self._new_rows(doc_ids, ordinals)
+        if keep.all():
+            return (doc_ids, user_ids, ordinals, filenames), vectors, list(texts)
+        print(f"⏭️ Skipping {int((~keep).sum())} chunks that are already stored or repeated")
+        columns = (
+            doc_ids[keep],
+            user_ids[keep],
+            ordinals[keep],
+            [name for name, k in zip(filenames, keep) if k],
+        )
+        return columns, vectors[keep], [text for text, k in zip(texts, keep) if k]
+
+    def _reset(self):
+        """Clear the writer-side buffers; readers keep the published snapshot until the next _publish"""
+        # L2-normalised float32 embedding matrix. In memory it is a growable
+        # array where only the first `_size` rows are live; when persisted it
+        # is a read-only memmap of the segment file.
+        self._matrix = None
+        self._size = 0
+        # Columnar per-row metadata, aligned with the matrix rows
+        self._meta_size = 0
+        self._doc_ids = np.empty(0, dtype=np.int64)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._ordinals = np.empty(0, dtype=np.int64)
+        self._file_ids = np.empty(0, dtype=np.int64)
+        self._filename_table = []
+        self._filename_lookup = {}
+        # Documents whose rows are tombstoned until the next compaction
+        self._deleted_docs = frozenset()
+        # Manifest the mapped view corresponds to (persisted stores only)
+        self._manifest = None
+
+    def get_metadata(self, row):
+        """Metadata dict for one stored row"""
+        return self._snapshot.metadata(row)
+
+    def has_document(self, document_id):
+        """True if any chunk of `document_id` is loaded"""
+        return int(document_id) in self._snapshot.doc_index
+
+    def document_rows(self, document_id):
+        """Row positions of a document's chunks, in chunk order"""
+        return self._snapshot.document_rows(document_id)
+
+    # ------------------------------------------------------------------
+    # Deletion
+    # ------------------------------------------------------------------
+    def delete_documents(self, document_ids):
+        """
+        Remove documents from search. Their rows are tombstoned at once (in
+        every process sharing the store) and dropped from memory and disk by
+        compaction, which starts in the background once deleted rows reach
+        settings.VECTOR_COMPACT_RATIO of the store. Returns the number of rows removed.
+        """
+        document_ids = {int(d_id) for d_id in document_ids}
+        # Ids are tombstoned even without rows yet, so chunks an in-flight
+        # ingestion appends after the delete never become searchable
+        if self._storage is not None:
+            with self._lock, self._storage.lock():
+                self._sync_view(self._storage.read_manifest())
+                document_ids -= self._deleted_docs
+                if not document_ids:
+                    return 0
+                removed = self._row_count(document_ids)
+                self._sync_view(self._storage.delete_documents(document_ids))
+        else:
+            with self._lock:
+                document_ids -= self._deleted_docs
+                if not document_ids:
+                    return 0
+                removed = self._row_count(document_ids)
+                self._deleted_docs = self._deleted_docs | document_ids
+                snapshot = self._snapshot
+                self._publish(self._matrix[:self._size], snapshot.texts, snapshot.index, self._size)
+        print(f"🗑️ Removed {removed} chunks of {len(document_ids)} deleted document(s) from search")
+        self._maybe_compact()
+        return removed
+
+    def _row_count(self, document_ids):
+        """Number of rows the documents have in the store"""
+        doc_index = self._snapshot.doc_index
+        return sum(len(doc_index.get(d_id, EMPTY_ROWS)) for d_id in document_ids)
+
+    def _maybe_compact(self):
+        """Start a background compaction if enough of the store is deleted rows"""
+        snapshot = self._snapshot
+        ratio = getattr(settings, "VECTOR_COMPACT_RATIO", 0.2)
+        min_rows = getattr(settings, "VECTOR_COMPACT_MIN_ROWS", 1000)
+        dead = snapshot.dead_rows
+        if ratio <= 0 or dead < min_rows or dead < ratio * len(snapshot.texts):
+            return
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="vectorstore-compaction", daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"⚠️ Vector store compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """
+        Rewrite the store without the rows of deleted documents: a new segment
+        generation on disk (other processes remap it on their next refresh)
+        and a rebuilt search index. Returns the number of rows dropped.
+        """
+        started = time.perf_counter()
+        if self._storage is not None:
+            with self._lock, self._storage.lock():
+                self._sync_view(self._storage.read_manifest())
+                snapshot = self._snapshot
+                if snapshot.live_rows is None:
+                    return 0
+                manifest = self._storage.compact(self._manifest, snapshot.live_rows)
+                if snapshot.lexical is not None:
+                    # Renumbered postings, so no process re-tokenizes the new segment
+                    self._save_lexical(manifest["segment"], snapshot.lexical.compacted(snapshot.deleted))
+                self._sync_view(manifest)
+        else:
+            with self._lock:
+                snapshot = self._snapshot
+                live = snapshot.live_rows
+                if live is None:
+                    return 0
+                self._matrix = self._matrix[live]
+                self._size = len(live)
+                self._doc_ids = self._doc_ids[live]
+                self._user_ids = self._user_ids[live]
+                self._ordinals = self._ordinals[live]
+                self._file_ids = self._file_ids[live]
+                self._meta_size = len(live)
+                # Tombstones are kept so chunks appended later for a deleted document stay hidden
+                texts = tuple(snapshot.texts[row] for row in live.tolist())
+                lexical = snapshot.lexical
+                if lexical is not None:
+                    lexical = lexical.from_arrays(lexical.compacted(snapshot.deleted))
+                self._publish(self._matrix, texts, snapshot.index.rebuild(self._matrix), lexical=lexical)
+        print(
+            f"🧹 Compacted vector store: dropped {snapshot.dead_rows} deleted chunks, "
+            f"{len(self.texts)} left ({time.perf_counter() - started:.2f}s)"
+        )
+        return snapshot.dead_rows
+
+    def next_ordinal(self, document_id):
+        """Chunk ordinal to resume a document from: one past the highest stored"""
+        return self._snapshot.next_ordinal(document_id)
+
+    def get_document_chunks(self, document_id, limit=None):
+        """Texts of a document's chunks, in chunk order"""
+        snapshot = self._snapshot
+        rows = snapshot.document_rows(document_id)
+        if limit is not None:
+            rows = rows[:limit]
+        return [snapshot.texts[row] for row in rows]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+    def _map_segment(self, manifest):
+        """Point the writer's matrix at the committed part of the segment files"""
+        view = self._storage.open_view(manifest)
+        self._matrix = view["matrix"]
+        self._size = manifest["rows"]
+        self._filename_table = list(view["filenames"])
+        self._filename_lookup = {name: i for i, name in enumerate(self._filename_table)}
+        return view
+
+    def _open_view(self, manifest):
+        """Map the segment, rebuild the metadata columns and indexes, and publish them"""
+        self._reset()
+        view = self._map_segment(manifest)
+        meta = view["meta"]
+        self._doc_ids = np.array(meta[:, 0])
+        self._user_ids = np.array(meta[:, 1])
+        self._ordinals = np.array(meta[:, 2])
+        self._file_ids = np.array(meta[:, 3])
+        self._meta_size = len(meta)
+        self._deleted_docs = frozenset(manifest.get("deleted", ()))
+        self._manifest = manifest
+        matrix = self._matrix[:self._size]
+        index = self._snapshot.index.rebuild(matrix, generation=manifest["segment"])
+        self._publish(matrix, view["texts"], index, lexical=self._open_lexical(manifest["segment"], view["texts"]))
+
+    def _open_lexical(self, segment, texts):
+        """
+        BM25 index over a segment's `texts`: the postings saved for the segment
+        plus the rows after them, or built from scratch without a usable file.
+        None when hybrid search is off.
+        """
+        lexical = self._snapshot.lexical
+        if lexical is None:
+            return None
+        base = lexical.reset()
+        try:
+            arrays = self._storage.read_postings(segment)
+            if arrays is not None and len(arrays["lengths"]) <= len(texts):
+                base = lexical.from_arrays(arrays)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable BM25 postings of segment {segment}: {e}")
+        start = base.rows
+        lexical = base.add(texts[start:], start)
+        if len(texts) - start >= LEXICAL_SAVE_ROWS:
+            self._save_lexical(segment, lexical.to_arrays())
+        return lexical
+
+    def _save_lexical(self, segment, arrays):
+        try:
+            self._storage.write_postings(segment, arrays)
+        except Exception as e:
+            print(f"⚠️ Error saving BM25 postings of segment {segment}: {e}")
+
+    def _sync_view(self, manifest):
+        """
+        Bring the mapped view up to `manifest`. Rows appended to the same
+        segment are mapped and indexed incrementally, and new tombstones only
+        republish; anything else (a new segment after compaction, fewer rows)
+        remaps from scratch.
+        """
+        if manifest is None or manifest == self._manifest:
+            return
+        current = self._manifest
+        if current is None or manifest["segment"] != current["segment"] or manifest["rows"] < self._size:
+            self._open_view(manifest)
+            return
+        start = self._size
+        view = self._map_segment(manifest)
+        meta = view["meta"][start:]
+        self._append_columns(meta[:, 0], meta[:, 1], meta[:, 2], meta[:, 3])
+        self._deleted_docs = frozenset(manifest.get("deleted", ()))
+        self._manifest = manifest
+        matrix = self._matrix[:self._size]
+        index = self._snapshot.index.add(np.asarray(matrix[start:]), matrix)
+        self._publish(matrix, view["texts"], index, start)
+
+    def refresh(self):
+        """
+        Pick up rows that other processes committed to the shared segment files.
+        Only a stat of the manifest when nothing changed, so it is cheap to call
+        on every request. Never waits for a writer: if one holds the lock, it
+        publishes the new rows itself. Returns True if new rows were mapped.
+        """
+        if self._storage is None:
+            return False
+        token = self._storage.manifest_token()
+        if token is None or token == self._manifest_token:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            manifest = self._storage.read_manifest()
+            version = self.version
+            self._sync_view(manifest)
+            # Only after a successful sync, so a failed one is retried next time
+            self._manifest_token = token
+            if self.version != version:
+                print(f"🔄 Mapped new rows from {self.persist_path} ({self._size} total)")
+            return self.version != version
+        finally:
+            self._lock.release()
+
+    def _load_from_disk(self):
+        """Map the persisted segment; migrates an old pickle snapshot if present"""
+        try:
+            self._manifest_token = self._storage.manifest_token()
+            manifest = self._storage.read_manifest()
+            if manifest is None:
+                legacy_path = Path(self.persist_path) / LEGACY_PICKLE
+                if legacy_path.exists():
+                    self._migrate_pickle(legacy_path)
+                else:
+                    print(f"📂 No existing vector store found at {self.persist_path}, starting fresh")
+                return
+            with self._lock:
+                self._open_view(manifest)
+            print(f"✅ Loaded {self._size} chunks from {self.persist_path}")
+        except Exception as e:
+            print(f"⚠️ Error loading vector store from {self.persist_path}: {e}")
+            # Reset to empty on error
+            with self._lock:
+                self._reset()
+                snapshot = self._snapshot
+                lexical = snapshot.lexical and snapshot.lexical.reset()
+                self._snapshot = Snapshot.empty(snapshot.index.reset(), lexical, snapshot.version + 1)
+
+    def _migrate_pickle(self, legacy_path):
+        """Import a pickle snapshot from older versions into the segment format"""
+        with open(legacy_path, 'rb') as f:
+            data = pickle.load(f)
+        texts = list(data.get('texts', []))
+        embeddings = data.get('embeddings', [])
+        if len(embeddings):
+            vectors = np.stack([np.asarray(e, dtype=np.float32) for e in embeddings])
+            texts, metadata = self._unpack_metadata(texts, data.get('metadata'))
+            self._append_rows(vectors, texts, metadata)
+        os.replace(legacy_path, str(legacy_path) + '.migrated')
+        print(f"✅ Migrated {len(texts)} chunks from {legacy_path}")
+
+    @staticmethod
+    def _unpack_metadata(texts, columns):
+        """
+        Rebuild per-row metadata from a pickle snapshot. The oldest snapshots
+        have no metadata columns, so the id/filename header is parsed out of each text.
+        """
+        if columns:
+            keys = [k for k in ('document_id', 'user_id', 'chunk', 'filename') if k in columns]
+            metadata = []
+            for i in range(len(texts)):
+                meta = {k: columns[k][i] for k in keys}
+                for k in ('document_id', 'user_id'):
+                    if meta.get(k) == NO_ID:
+                        meta[k] = None
+                metadata.append(meta)
+            return texts, metadata
+
+        stripped, metadata = [], []
+        for text in texts:
+            match = LEGACY_MARKER.match(text)
+            if match:
+                stripped.append(text[match.end():])
+                metadata.append({"document_id": int(match.group(1)), "filename": match.group(2)})
+            else:
+                stripped.append(text)
+                metadata.append({})
+        return stripped, metadata
+
+    def _encode(self, texts, batch_size=None):
+        """
+        Encode texts in batches and return an (n, dim) array in input order.
+        Sorting by length groups similar-sized chunks so batches need less padding.
+        """
+        batch_size = batch_size or getattr(settings, "EMBEDDING_BATCH_SIZE", 32)
+        order = list(range(len(texts)))
+        if getattr(settings, "EMBEDDING_SORT_BY_LENGTH", True):
+            order.sort(key=lambda i: len(texts[i]), reverse=True)
+
+        embeddings = None
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            batch = self.model.encode(
+                [texts[i] for i in batch_idx],
+                batch_size=batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            )
+            batch = np.asarray(batch, dtype=np.float32)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[batch_idx] = batch
+        return embeddings
+
+    def encode_texts(self, texts, batch_size=None):
+        """Embed texts in batches. Returns an (n, dim) float32 array, or None without a model."""
+        self._load_model()
+        if self.model is None:
+            print(
+                "❌ Cannot encode: Model is not loaded. "
+                "Check if sentence-transformers or the ONNX export is installed."
+            )
+            return None
+
+        texts = list(texts)
+        if not texts:
+            return None
+
+        print(f"📝 Vectorizing {len(texts)} new chunks...")
+        started = time.perf_counter()
+        embs = self._encode(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+        rate = len(texts) / elapsed if elapsed > 0 else float("inf")
+        print(f"⚡ Embedded {len(texts)} chunks in {elapsed:.2f}s ({rate:.1f} chunks/sec)")
+        return embs
+
+    def add_embeddings(self, texts, embeddings, metadata=None):
+        """
+        Store texts with precomputed embeddings (no model inference).
+        Returns the number of chunks added.
+        """
+        texts = list(texts)
+        if not texts:
+            return 0
+        try:
+            added = self._append_rows(embeddings, texts, metadata)
+            print(f"✅ Current total chunks in store: {len(self.texts)}")
+            return added
+        except Exception as e:
+            print(f"❌ Error adding texts to vector store: {e}")
+            return 0
+
+    def add_texts(self, texts, metadata=None, batch_size=None):
+        """
+        Embed and store texts. Returns the number of chunks added.
+        `metadata` is one dict applied to every text or a list with one dict per
+        text; recognised keys are document_id, user_id, filename and chunk.
+        """
+        texts = list(texts)
+        try:
+            embs = self.encode_texts(texts, batch_size=batch_size)
+        except Exception as e:
+            print(f"❌ Error adding texts to vector store: {e}")
+            return 0
+        if embs is None:
+            return 0
+        return self.add_embeddings(texts, embs, metadata)
+
+    def _search_rows(self, query, top_k, document_ids=None, user_id=None):
+        """
+        (snapshot, rows, scores) of the `top_k` best matches; rows index into
+        the returned snapshot, which the whole search ran against.
+        With `document_ids` and/or `user_id`, only rows matching those filters are
+        scored, so the cost follows the size of the selected documents.
+        """
+        self._load_model()
+        self.refresh()
+        snapshot = self._snapshot
+        if not snapshot.texts:
+            print("📭 Vector store is empty. No context to retrieve.")
+            return snapshot, [], []
+        if self.model is None:
+            print("❌ Cannot search: Model is not loaded.")
+            return snapshot, [], []
+
+        candidates = snapshot.candidate_rows(document_ids, user_id)
+        if candidates is not None and len(candidates) == 0:
+            print("📭 No chunks loaded for the requested documents.")
+            return snapshot, [], []
+
+        query_key = normalize_query(query)
+        filters = (
+            None if document_ids is None else tuple(sorted({int(d) for d in document_ids})),
+            None if user_id is None else int(user_id),
+        )
+        result_key = (query_key, filters, top_k, snapshot.version)
+        cached = self._result_cache.get(result_key)
+        if cached is not None:
+            print(f"🔍 Cached results for query: '{query}'")
+            return snapshot, list(cached[0]), list(cached[1])
+
+        print(f"🔍 Searching context for query: '{query}'...")
+        query_emb = self._embed_query(query_key)
+        if snapshot.lexical is None:
+            rows, scores = snapshot.index.search(snapshot.matrix, query_emb, top_k, candidates)
+        else:
+            # Hybrid: fuse the dense and BM25 rankings of a deeper candidate list
+            depth = max(top_k, getattr(settings, "HYBRID_CANDIDATES", 50))
+            dense_rows, _ = snapshot.index.search(snapshot.matrix, query_emb, depth, candidates)
+            lexical_rows, _ = snapshot.lexical.search(query_key, depth, candidates, deleted=snapshot.deleted)
+            rows, scores = reciprocal_rank_fusion(
+                [dense_rows, lexical_rows], top_k, k=getattr(settings, "RRF_K", 60)
+            )
+        self._result_cache.put(result_key, (tuple(rows), tuple(scores)))
+        return snapshot, rows, scores
+
+    def _embed_query(self, query_key):
+        """Normalised query embedding, reused across repeats of the same question"""
+        query_emb = self._query_cache.get(query_key)
+        if query_emb is None:
+            query_emb = self._normalize(self.model.encode(query_key))[0]
+            query_emb.setflags(write=False)
+            self._query_cache.put(query_key, query_emb)
+        return query_emb
+
+    def cache_stats(self):
+        """Hit/miss counters of the query-embedding and result caches"""
+        return {
+            "version": self.version,
+            "query_embeddings": self._query_cache.stats(),
+            "results": self._result_cache.stats(),
+        }
+
+    def similarity_search(self, query, top_k=3, document_ids=None, user_id=None):
+        snapshot, rows, _ = self._search_rows(query, top_k, document_ids=document_ids, user_id=user_id)
+        return [snapshot.texts[row] for row in rows]
+
+    def similarity_search_with_metadata(self, query, top_k=3, document_ids=None, user_id=None):
+        """
+        Like similarity_search, but returns dicts with text, score and row
+        metadata. "score" is the cosine similarity to the query, except with
+        settings.RETRIEVAL_HYBRID on (the default), where it is the reciprocal
+        rank fusion score: sum(1 / (RRF_K + rank)) over the dense and BM25
+        rankings, at most 2 / (RRF_K + 1). It orders results but is not
+        comparable to a similarity.
+        """
+        snapshot, rows, scores = self._search_rows(query, top_k, document_ids=document_ids, user_id=user_id)
+        return [
+            {"text": snapshot.texts[row], "score": score, **snapshot.metadata(row)}
+            for row, score in zip(rows, scores)
+        ]
+
+
+# 🔥 GLOBAL STORE with persistence
+def get_vectorstore_path():
+    """Get the directory for the persistent vector store"""
+    # Use a fixed path relative to the project root for reliability
+    base_dir = Path(__file__).resolve().parent.parent.parent
+    vectorstore_dir = base_dir / 'vectorstore_data'
+    vectorstore_dir.mkdir(exist_ok=True)
+    return str(vectorstore_dir)
+
+# Initialize once at module level
+GLOBAL_VECTOR_STORE = SimpleVectorStore(persist_path=get_vectorstore_path())
+
+def initialize_vectorstore():
+    """Returns the global vector store instance"""
+    return GLOBAL_VECTOR_STORE
@@ -0,0 +1,30 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Conversation, Document
+
+
+@receiver(post_delete, sender=Document)
+def forget_document_chunks(sender, instance, **kwargs):
+    """
+    Remove a deleted document's chunks from the vector store once the delete
+    commits (covers deleting a chat, a user, or a Document in the admin).
+    """
+    document_id = instance.id
+
+    def forget():
+        from .rag.rag_pipeline import forget_documents
+
+        try:
+            forget_documents([document_id])
+        except Exception as e:
+            print(f"⚠️ Could not remove document {document_id} from the vector store: {e}")
+
+    transaction.on_commit(forget)
+
+
+@receiver(post_delete, sender=Document)
+def prune_document_lists(sender, instance, **kwargs):
+    """Take a deleted document out of the chats it was uploaded to, in the same transaction"""
+    Conversation.remove_document(instance)
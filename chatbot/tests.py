@@ -1 +1,186 @@
-# Tests will be added later
+import importlib.util
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .models import ChatMessage, Conversation, Document
+from .rag import rag_pipeline
+from .rag.embeddings import ONNX_EXPORT_DIR, ONNX_MODEL_FILE, OnnxEmbedder, load_embedding_model
+from .rag.vectorstore import SimpleVectorStore
+
+
+def _onnx_export_dir():
+    return getattr(settings, "EMBEDDING_ONNX_DIR", None) or ONNX_EXPORT_DIR
+
+
+def _parity_available():
+    return (
+        importlib.util.find_spec("onnxruntime") is not None
+        and importlib.util.find_spec("sentence_transformers") is not None
+        and (Path(_onnx_export_dir()) / ONNX_MODEL_FILE).exists()
+    )
+
+
+@unittest.skipUnless(_parity_available(), "needs sentence-transformers, onnxruntime and the ONNX export")
+class OnnxEmbeddingParityTests(SimpleTestCase):
+    """The int8 ONNX backend must embed like the torch model it was exported from"""
+
+    SENTENCES = [
+        "The quarterly report shows revenue growth across all regions.",
+        "How do I reset my password?",
+        "Photosynthesis converts light energy into chemical energy.",
+        "The contract terminates automatically after twelve months unless renewed in writing.",
+        "short",
+        "word " * 400,  # longer than the model's window; both truncate
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.torch_model = load_embedding_model("torch")
+        cls.onnx_model = OnnxEmbedder(_onnx_export_dir())
+
+    def test_cosine_agreement(self):
+        expected = self.torch_model.encode(self.SENTENCES, convert_to_numpy=True)
+        actual = self.onnx_model.encode(self.SENTENCES)
+        self.assertEqual(actual.shape, expected.shape)
+        cosine = (expected * actual).sum(axis=1) / (
+            np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+        )
+        self.assertGreater(cosine.min(), 0.98)
+
+    def test_same_nearest_neighbours(self):
+        query = "password reset"
+        docs = self.SENTENCES[:4]
+        rankings = []
+        for model in (self.torch_model, self.onnx_model):
+            scores = np.asarray(model.encode(docs)) @ np.asarray(model.encode(query))
+            rankings.append(np.argsort(-scores).tolist())
+        self.assertEqual(rankings[0][0], rankings[1][0])
+
+    def test_single_string_returns_vector(self):
+        self.assertEqual(self.onnx_model.encode("hello").shape, (self.onnx_model.encode(["hello"]).shape[1],))
+
+
+@override_settings(LLM_ANSWER_CACHE=False)
+class ChatQueryBudgetTests(TestCase):
+    """A chat message costs a fixed number of queries, however long the chat and however many documents"""
+
+    # session, user, conversation, history, document metadata (retrieval), reply insert
+    QUERIES_PER_MESSAGE = 6
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="alice", password="secret")
+        self.client.force_login(self.user)
+        self.conversation = Conversation.objects.create(user=self.user, title="Quarterly numbers")
+
+    def _add_documents(self, count):
+        for _ in range(count):
+            name = f"report-{len(self.conversation.document_list)}.txt"
+            doc = Document.objects.create(user=self.user, file=f"documents/{name}", status=Document.STATUS_READY)
+            ChatMessage.objects.create(
+                conversation=self.conversation,
+                user=self.user,
+                message_type="document",
+                uploaded_file_name=name,
+                document=doc,
+            )
+            self.conversation.add_document(doc, name)
+
+    def _add_history(self, count):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(conversation=self.conversation, user=self.user, user_message=f"q{i}", bot_reply=f"a{i}")
+            for i in range(count)
+        )
+
+    def _post_message(self):
+        doc_ids = {entry["id"] for entry in self.conversation.document_list}
+        store = rag_pipeline.GLOBAL_VECTOR_STORE
+        # Retrieval without a model: the documents count as synced and search finds nothing
+        with patch("chatbot.views.aget_ai_reply", return_value="Revenue grew.") as get_ai_reply, \
+                patch.object(rag_pipeline, "_COMPLETE_DOCUMENTS", doc_ids), \
+                patch.object(store, "similarity_search_with_metadata", return_value=[]):
+            response = self.client.post(
+                reverse("conversation", args=[self.conversation.id]),
+                {"message": "How did revenue develop?"},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            )
+        self.assertEqual(response.json()["bot_reply"], "Revenue grew.")
+        return get_ai_reply.call_args.kwargs
+
+    def test_query_count_does_not_grow_with_documents_or_history(self):
+        for documents, history in ((1, 0), (10, 40)):
+            with self.subTest(documents=documents, history=history):
+                self._add_documents(documents)
+                self._add_history(history)
+                with self.assertNumQueries(self.QUERIES_PER_MESSAGE):
+                    context = self._post_message()
+                names = [entry["name"] for entry in self.conversation.document_list]
+                self.assertEqual(context["doc_manifest"], names)
+
+    def test_upload_appends_to_document_list_in_order(self):
+        self._add_documents(2)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        with patch("chatbot.views.enqueue_ingestion"), override_settings(MEDIA_ROOT=media_root.name):
+            self.client.post(
+                reverse("conversation", args=[self.conversation.id]),
+                {"document": SimpleUploadedFile("notes.txt", b"hello")},
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            )
+        self.conversation.refresh_from_db()
+        self.assertEqual(
+            [entry["name"] for entry in self.conversation.document_list],
+            ["report-0.txt", "report-1.txt", "notes.txt"],
+        )
+
+
+class _ConstantModel:
+    """Embeds every query as the same unit vector"""
+
+    max_seq_length = 256
+
+    def encode(self, sentences, **kwargs):
+        return np.full(4, 0.5, dtype=np.float32)
+
+
+@override_settings(VECTOR_COMPACT_RATIO=0)
+class VectorStoreDeletionTests(SimpleTestCase):
+    """Chunks of a deleted document never come back, even if its ingestion is still running"""
+
+    def _add(self, store, document_id, count):
+        rng = np.random.default_rng(document_id)
+        store.add_embeddings(
+            [f"chunk {i} of document {document_id}" for i in range(count)],
+            rng.standard_normal((count, 4)).astype(np.float32),
+            [{"document_id": document_id, "chunk": store.next_ordinal(document_id) + i} for i in range(count)],
+        )
+
+    def _searchable_documents(self, store):
+        store.model = _ConstantModel()
+        return {result["document_id"] for result in store.similarity_search_with_metadata("chunk", top_k=50)}
+
+    def test_late_chunks_stay_hidden_after_compaction(self):
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        for persist_path in (None, store_dir.name):
+            with self.subTest(persisted=persist_path is not None):
+                store = SimpleVectorStore(persist_path=persist_path)
+                self._add(store, 1, 5)
+                self._add(store, 2, 3)  # document 2 is still being ingested...
+                store.delete_documents([2])  # ...when it is deleted
+                self.assertEqual(store.compact(), 3)
+                self._add(store, 2, 4)  # the ingestion worker stores its last chunks
+                self.assertFalse(store.has_document(2))
+                self.assertEqual(self._searchable_documents(store), {1})
+                if persist_path:
+                    self.assertEqual(self._searchable_documents(SimpleVectorStore(persist_path=persist_path)), {1})
+
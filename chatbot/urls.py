@@ -5,6 +5,9 @@ from . import views
 urlpatterns = [
     path("", views.home, name="home"),
     path("chat/<int:conversation_id>/", views.home, name="conversation"),  # ✅ ADD
+    path("chat/<int:conversation_id>/stream/", views.chat_stream, name="chat_stream"),
+    path("chat/<int:conversation_id>/messages/", views.conversation_messages, name="conversation_messages"),
+    path("conversations/", views.conversation_list, name="conversation_list"),
     path("new-chat/", views.new_chat, name="new_chat"),
 
     path("signup/", views.signup, name="signup"),
@@ -19,5 +22,6 @@ urlpatterns = [
 
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
     path("delete/<int:convo_id>/", views.delete_chat, name="delete_chat"),
+    path("document/<int:document_id>/status/", views.document_status, name="document_status"),
     path("health/", views.health_check, name="health_check"),
 ]
@@ -1,158 +1,429 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.urls import reverse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
 
 from .models import ChatMessage, Conversation, Document
-from .openai_client import get_ai_reply
+from .ingestion import enqueue_ingestion
+from .openai_client import aget_ai_reply, astream_ai_reply, clean_llm_response
+
+from .rag import rag_pipeline
+from .rag.rag_pipeline import prepare_retrieval, search_context
+
+
+def _handle_upload(user, conversation, uploaded_file):
+    """Save an uploaded document, queue its ingestion and log it in the chat"""
+    if not uploaded_file:
+        return None
+
+    doc_obj = Document.objects.create(
+        user=user, file=uploaded_file, status=Document.STATUS_PENDING
+    )
+    conversation.active_document = doc_obj
+    conversation.save(update_fields=["active_document"])
+    conversation.add_document(doc_obj, uploaded_file.name)
+
+    # Extraction/embedding runs in the background; the chat uses
+    # whatever chunks are ready when a question comes in.
+    enqueue_ingestion(doc_obj.id)
+
+    ChatMessage.objects.create(
+        conversation=conversation,
+        user=user,
+        message_type="document",
+        uploaded_file_name=uploaded_file.name,
+        document=doc_obj,
+    )
+    return doc_obj
+
+
+def _off_thread(func):
+    """
+    sync_to_async for slow work that needs no request state: it runs on a
+    pooled thread instead of the one thread Django shares between sync views
+    and thread-sensitive calls, so other requests are not queued behind it.
+    DB connections the work opens on that thread are closed when it finishes.
+    """
+    def run(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def _load_chat_state(conversation):
+    """History, document ids/names and prepared retrieval state for a new message"""
+    # Get history (one query on the conversation/type/created_at index)
+    history_qs = (
+        ChatMessage.objects.filter(conversation=conversation, message_type="text")
+        .order_by("-created_at")
+        .values_list("user_message", "bot_reply")[:6]
+    )
+    history_text = ""
+    for user_message, bot_reply in reversed(history_qs):
+        history_text += f"User: {user_message}\nBot: {bot_reply}\n"
+
+    # Get Documents and Manifest (Ordered by upload time, kept on the conversation)
+    doc_ids = [entry["id"] for entry in conversation.document_list]
+    doc_manifest = [entry["name"] for entry in conversation.document_list]
+
+    prepared = None
+    if doc_ids:
+        try:
+            prepared = prepare_retrieval(doc_ids)
+        except Exception as e:
+            print(f"⚠️ Context retrieval failed: {e}")
+    return history_text, doc_ids, doc_manifest, prepared
+
+
+def _search_documents(user_msg, doc_ids, prepared):
+    try:
+        # Pass the full document list so ordinal logic knows the count
+        return "\n".join(search_context(user_msg, doc_ids, *prepared))
+    except Exception as e:
+        print(f"⚠️ Context retrieval failed: {e}")
+        return ""
+
+
+async def _build_chat_context(conversation, user_msg):
+    """
+    Assemble the aget_ai_reply/astream_ai_reply arguments for a new message.
+    The DB reads run on Django's sync thread; embedding the question and
+    searching run off it (see _off_thread).
+    """
+    history_text, doc_ids, doc_manifest, prepared = await sync_to_async(_load_chat_state)(conversation)
+    document_text = ""
+    if prepared is not None:
+        document_text = await _off_thread(_search_documents)(user_msg, doc_ids, prepared)
+
+    return {
+        "message": user_msg,
+        "history_text": history_text,
+        "document_text": document_text,
+        "doc_manifest": doc_manifest,  # ✅ NEW: Tell AI about ALL docs
+    }
+
+
+def _save_reply(user, conversation, user_msg, bot_reply):
+    ChatMessage.objects.create(
+        conversation=conversation,
+        user=user,
+        message_type="text",
+        user_message=user_msg,
+        bot_reply=bot_reply,
+    )
 
-from .rag.rag_pipeline import ingest_document, retrieve_context
+    if conversation.title == "New chat":
+        conversation.title = user_msg[:40]
+        conversation.save(update_fields=["title"])
 
 
-def home(request, conversation_id=None):
+# ===============================
+# Cursor pagination
+# ===============================
+# Listings run newest first on (created_at, id), the order of the
+# conversation and chat message indexes. A cursor is the opaque position of
+# the last row of a page; the next page holds the rows strictly older than it.
+
+MAX_PAGE_SIZE = 100
+
+HISTORY_FIELDS = ("id", "message_type", "user_message", "bot_reply", "uploaded_file_name", "created_at")
+SIDEBAR_FIELDS = ("id", "title", "created_at")
+
+
+def _encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """(created_at, id) of a cursor, or None if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        return None
+
+
+def _page(queryset, before=None, limit=None):
+    """
+    Up to `limit` rows of `queryset` older than the `before` position, newest
+    first, and the cursor of the next page (None on the last page).
+    """
+    if before:
+        created_at, pk = before
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    rows = list(queryset.order_by("-created_at", "-id")[:limit + 1])
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def _history_page(conversation, before=None, limit=None):
+    """A page of chat messages in display (oldest first) order"""
+    limit = limit or settings.CHAT_HISTORY_PAGE_SIZE
+    messages, next_cursor = _page(
+        ChatMessage.objects.filter(conversation=conversation).only(*HISTORY_FIELDS), before, limit
+    )
+    messages.reverse()
+    return messages, next_cursor
+
+
+def _conversation_page(user, before=None, limit=None):
+    """A page of the sidebar: ids and titles only, newest first"""
+    limit = limit or settings.CONVERSATION_PAGE_SIZE
+    return _page(Conversation.objects.filter(user=user).only(*SIDEBAR_FIELDS), before, limit)
+
+
+def _page_args(request):
+    """(before, limit, error response) from ?before=<cursor>&limit=<n>"""
+    before = None
+    if request.GET.get("before"):
+        before = _decode_cursor(request.GET["before"])
+        if before is None:
+            return None, None, JsonResponse({"error": "invalid cursor"}, status=400)
+    try:
+        limit = min(max(int(request.GET.get("limit", 0)), 0), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = 0
+    return before, limit or None, None
+
+
+def _resolve_conversation(user, conversation_id):
+    if conversation_id:
+        return get_object_or_404(Conversation, id=conversation_id, user=user)
+    conversation = (
+        Conversation.objects.filter(user=user).order_by("-created_at").first()
+    )
+    if not conversation:
+        conversation = Conversation.objects.create(user=user, title="New chat")
+    return conversation
+
+
+async def home(request, conversation_id=None):
+    """
+    The chat page, and the form/AJAX endpoint for new messages. Async so that,
+    under the ASGI server, retrieval runs off the thread that serves sync views
+    (see _build_chat_context) and waiting on the LLM holds no thread at all.
+    """
     # ✅ RENDER HEALTH CHECK BYPASS
     # If Render's health checker hits '/', return 200 instead of a 302 redirect
     if "Go-http-client" in request.META.get("HTTP_USER_AGENT", ""):
         return JsonResponse({"status": "healthy", "source": "root_bypass"})
 
+    if request.method != "POST":
+        return await sync_to_async(_render_home)(request, conversation_id)
+
     # Manual login check since we removed the decorator
-    if not request.user.is_authenticated:
+    user = await request.auser()
+    if not user.is_authenticated:
         return redirect("login")
 
-    user = request.user
+    conversation = await sync_to_async(_resolve_conversation)(user, conversation_id)
 
     # ===============================
-    # Resolve active conversation
+    # Handle POST
     # ===============================
-    if conversation_id:
-        conversation = get_object_or_404(Conversation, id=conversation_id, user=user)
-    else:
-        conversation = (
-            Conversation.objects.filter(user=user).order_by("-created_at").first()
+    is_ajax = request.headers.get("x-requested-with") == "XMLHttpRequest"
+
+    # 1. Handle Document Upload (if any)
+    uploaded_file = request.FILES.get("document")
+    doc_obj = await sync_to_async(_handle_upload)(user, conversation, uploaded_file)
+
+    # 2. Handle Text Message (if any)
+    user_msg = request.POST.get("message", "").strip()
+    bot_reply = ""
+
+    if user_msg:
+        context = await _build_chat_context(conversation, user_msg)
+        bot_reply = await aget_ai_reply(**context)
+        await sync_to_async(_save_reply)(user, conversation, user_msg, bot_reply)
+
+    # 3. Return Response
+    if is_ajax:
+        return JsonResponse(
+            {
+                "status": "success",
+                "bot_reply": bot_reply,
+                "user_msg": user_msg,
+                "uploaded_file": uploaded_file.name if uploaded_file else None,
+                "document": _document_status(doc_obj) if doc_obj else None,
+            }
         )
-        if not conversation:
-            conversation = Conversation.objects.create(user=user, title="New chat")
 
-    # ===============================
-    # Handle POST
-    # ===============================
-    if request.method == "POST":
-        is_ajax = request.headers.get("x-requested-with") == "XMLHttpRequest"
-
-        # 1. Handle Document Upload (if any)
-        uploaded_file = request.FILES.get("document")
-        doc_obj = None
-        if uploaded_file:
-            doc_obj = Document.objects.create(user=user, file=uploaded_file)
-            conversation.active_document = doc_obj
-            conversation.save()
-
-            try:
-                ingest_document(
-                    user=user, uploaded_file=uploaded_file, document_id=doc_obj.id
-                )
-            except Exception as e:
-                print(f"❌ Error during document ingestion: {e}")
-
-            ChatMessage.objects.create(
-                conversation=conversation,
-                user=user,
-                message_type="document",
-                uploaded_file_name=uploaded_file.name,
-                document=doc_obj,
-            )
-
-        # 2. Handle Text Message (if any)
-        user_msg = request.POST.get("message", "").strip()
-        bot_reply = ""
-
-        if user_msg:
-            # Get history
-            history_qs = (
-                ChatMessage.objects.filter(conversation=conversation)
-                .exclude(message_type="document")
-                .order_by("-created_at")[:6]
-            )
-            history_text = ""
-            for m in reversed(history_qs):
-                history_text += f"User: {m.user_message}\nBot: {m.bot_reply}\n"
-
-            # Get Documents and Manifest (Ordered by upload time)
-            doc_messages = ChatMessage.objects.filter(
-                conversation=conversation, message_type="document"
-            ).order_by("created_at")
-
-            doc_ids = []
-            doc_manifest = []
-            seen_ids = set()
-            for msg in doc_messages:
-                if msg.document_id and msg.document_id not in seen_ids:
-                    doc_ids.append(msg.document_id)
-                    doc_manifest.append(msg.uploaded_file_name)
-                    seen_ids.add(msg.document_id)
-
-            document_text = ""
-            if doc_ids:
-                try:
-                    # Pass the full document list so ordinal logic knows the count
-                    document_text = "\n".join(
-                        retrieve_context(question=user_msg, document_ids=doc_ids)
-                    )
-                except Exception as e:
-                    print(f"⚠️ Context retrieval failed: {e}")
-
-            bot_reply = get_ai_reply(
-                message=user_msg,
-                history_text=history_text,
-                document_text=document_text,
-                doc_manifest=doc_manifest,  # ✅ NEW: Tell AI about ALL docs
-            )
-
-            ChatMessage.objects.create(
-                conversation=conversation,
-                user=user,
-                message_type="text",
-                user_message=user_msg,
-                bot_reply=bot_reply,
-            )
-
-            if conversation.title == "New chat":
-                conversation.title = user_msg[:40]
-                conversation.save()
-
-        # 3. Return Response
-        if is_ajax:
-            return JsonResponse(
-                {
-                    "status": "success",
-                    "bot_reply": bot_reply,
-                    "user_msg": user_msg,
-                    "uploaded_file": uploaded_file.name if uploaded_file else None,
-                }
-            )
+    return redirect("conversation", conversation_id=conversation.id)
 
-        return redirect("conversation", conversation_id=conversation.id)
+
+def _render_home(request, conversation_id):
+    # Manual login check since we removed the decorator
+    if not request.user.is_authenticated:
+        return redirect("login")
+
+    conversation = _resolve_conversation(request.user, conversation_id)
 
     # ===============================
     # Load UI
     # ===============================
-    conversations = Conversation.objects.filter(user=user).order_by("-created_at")
-    chat_history = ChatMessage.objects.filter(conversation=conversation).order_by(
-        "created_at"
-    )
+    # Only the most recent page of each; the page fetches older ones on scroll
+    conversations, conversations_cursor = _conversation_page(request.user)
+    chat_history, history_cursor = _history_page(conversation)
 
     return render(
         request,
         "chatbot/index.html",
         {
             "chat_history": chat_history,
+            "history_cursor": history_cursor,
             "conversations": conversations,
+            "conversations_cursor": conversations_cursor,
             "active_conversation": conversation,
         },
     )
 
 
+@login_required
+def conversation_messages(request, conversation_id):
+    """
+    Chat history, one page at a time: the newest messages, or with
+    ?before=<next_cursor> the ones before them. Messages within a page are
+    oldest first.
+    """
+    before, limit, error = _page_args(request)
+    if error:
+        return error
+    conversation = get_object_or_404(Conversation.objects.only("id"), id=conversation_id, user=request.user)
+    messages, next_cursor = _history_page(conversation, before, limit)
+    return JsonResponse(
+        {
+            "messages": [
+                {
+                    "id": msg.id,
+                    "message_type": msg.message_type,
+                    "user_message": msg.user_message,
+                    "bot_reply": msg.bot_reply,
+                    "uploaded_file_name": msg.uploaded_file_name,
+                    "created_at": msg.created_at.isoformat(),
+                }
+                for msg in messages
+            ],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+@login_required
+def conversation_list(request):
+    """The user's conversations for the sidebar, newest first, one page at a time"""
+    before, limit, error = _page_args(request)
+    if error:
+        return error
+    conversations, next_cursor = _conversation_page(request.user, before, limit)
+    return JsonResponse(
+        {
+            "conversations": [
+                {
+                    "id": conv.id,
+                    "title": conv.title,
+                    "url": reverse("conversation", args=[conv.id]),
+                    "delete_url": reverse("delete_chat", args=[conv.id]),
+                }
+                for conv in conversations
+            ],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+def _document_status(doc):
+    return {
+        "id": doc.id,
+        "filename": doc.file.name.split("/")[-1],
+        "status": doc.status,
+        "progress": doc.progress,
+        "error": doc.error,
+        "status_url": reverse("document_status", args=[doc.id]),
+    }
+
+
+@login_required
+def document_status(request, document_id):
+    """Ingestion status/progress of one of the user's documents"""
+    doc = get_object_or_404(
+        Document.objects.only("id", "file", "status", "progress", "error"),
+        id=document_id,
+        user=request.user,
+    )
+    return JsonResponse(_document_status(doc))
+
+
+def _sse(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@login_required
+@require_POST
+async def chat_stream(request, conversation_id):
+    """
+    Same as an AJAX POST to home, but the reply is streamed as Server-Sent
+    Events while the model generates it:
+        {"type": "document", ...}   upload accepted (status as in document_status)
+        {"type": "token", "text"}   raw text delta
+        {"type": "done", "bot_reply"} final cleaned reply (saved to the chat)
+        {"type": "error", "error"}
+
+    Async so that, under the ASGI server, waiting on the LLM does not tie up
+    a worker thread; DB work runs via sync_to_async and retrieval off the
+    sync thread (see _build_chat_context).
+    """
+    user = await request.auser()
+    conversation = await sync_to_async(get_object_or_404)(Conversation, id=conversation_id, user=user)
+    doc_obj = await sync_to_async(_handle_upload)(user, conversation, request.FILES.get("document"))
+    user_msg = request.POST.get("message", "").strip()
+
+    async def events():
+        if doc_obj:
+            yield _sse({"type": "document", **_document_status(doc_obj)})
+        if not user_msg:
+            yield _sse({"type": "done", "bot_reply": ""})
+            return
+
+        parts = []
+        try:
+            context = await _build_chat_context(conversation, user_msg)
+            async for delta in astream_ai_reply(**context):
+                parts.append(delta)
+                yield _sse({"type": "token", "text": delta})
+        except Exception as e:
+            print(f"❌ Streaming reply failed: {e}")
+            yield _sse({"type": "error", "error": "Error connecting to AI."})
+            if not parts:
+                return
+
+        # Persist once the stream has ended (or broke after partial output)
+        bot_reply = clean_llm_response("".join(parts))
+        await sync_to_async(_save_reply)(user, conversation, user_msg, bot_reply)
+        yield _sse({"type": "done", "bot_reply": bot_reply})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let proxies buffer the stream
+    return response
+
+
 @login_required
 def new_chat(request):
     conversation = Conversation.objects.create(user=request.user, title="New chat")
@@ -174,10 +445,18 @@ def signup(request):
 @login_required
 def delete_chat(request, convo_id):
     conversation = get_object_or_404(Conversation, id=convo_id, user=request.user)
-    conversation.delete()
+    # Documents uploaded to the chat go with it; deleting them also removes
+    # their chunks from the vector store (see signals.py)
+    doc_ids = [entry["id"] for entry in conversation.document_list]
+    with transaction.atomic():
+        Document.objects.filter(id__in=doc_ids, user=request.user).delete()
+        conversation.delete()
     return redirect("home")
 
 
 def health_check(request):
-    """Health check endpoint for Render"""
-    return JsonResponse({"status": "ok", "service": "aibot"})
+    """Health check endpoint for Render (staff also get retrieval cache counters)"""
+    payload = {"status": "ok", "service": "aibot"}
+    if request.user.is_staff:
+        payload["retrieval_cache"] = rag_pipeline.GLOBAL_VECTOR_STORE.cache_stats()
+    return JsonResponse(payload)
@@ -8,9 +8,23 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+import threading
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbotapp.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402  (needs the settings module set above)
+
+if settings.EMBEDDING_WARMUP:
+    # Requests that need the model meanwhile wait for this load, not start another
+    from chatbot.rag.embeddings import warmup
+    threading.Thread(target=warmup, name="embedding-warmup", daemon=True).start()
+
+# Pick up documents left queued or half-processed by the previous process
+# (deploys and worker recycles); claiming keeps workers from doubling up
+from chatbot.ingestion import resume_ingestion  # noqa: E402
+
+threading.Thread(target=resume_ingestion, name="ingestion-resume", daemon=True).start()
@@ -59,6 +59,7 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "chatbotapp.urls"
 WSGI_APPLICATION = "chatbotapp.wsgi.application"
+ASGI_APPLICATION = "chatbotapp.asgi.application"
 
 # ====================================================
 # DATABASE — RENDER OVERRIDE + LOCAL FALLBACK
@@ -168,6 +169,143 @@ CSRF_TRUSTED_ORIGINS = [
 
 SECURE_PROXY_SSL_HEADER = ("HTTP_X_FORWARDED_PROTO", "https")
 
+# =========================
+# RAG / EMBEDDINGS
+# =========================
+
+# Chunks sent to the embedding model per forward pass during ingestion
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", "32"))
+# Sort chunks by length before batching to reduce padding
+EMBEDDING_SORT_BY_LENGTH = os.environ.get("EMBEDDING_SORT_BY_LENGTH", "True") == "True"
+
+# Embedding model: a sentence-transformers model name (cached in model_cache/)
+# or a local model directory; EMBEDDING_DEVICE "" lets torch pick (cpu, cuda, mps)
+EMBEDDING_MODEL_NAME = os.environ.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.environ.get("EMBEDDING_DEVICE", "")
+# Load and warm up the model in the background as each worker starts, instead
+# of on the first request that needs it
+EMBEDDING_WARMUP = os.environ.get("EMBEDDING_WARMUP", "False") == "True"
+
+# Embedding backend: "torch" (SentenceTransformer) or "onnx" (int8 ONNX export
+# made by download_model.py, run with onnxruntime; falls back to torch)
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_DIR = os.environ.get("EMBEDDING_ONNX_DIR", "")
+# onnxruntime intra-op threads (0 = one per core)
+EMBEDDING_ONNX_THREADS = int(os.environ.get("EMBEDDING_ONNX_THREADS", "0"))
+
+# Unix socket of the local embedding server (manage.py run_embedding_server).
+# When set, web workers send encode requests there instead of loading the model.
+EMBEDDING_SERVER_SOCKET = os.environ.get("EMBEDDING_SERVER_SOCKET", "")
+# Micro-batching: wait up to MAX_WAIT_MS for up to MAX_BATCH texts per forward pass
+EMBEDDING_SERVER_MAX_BATCH = int(os.environ.get("EMBEDDING_SERVER_MAX_BATCH", "64"))
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_SERVER_MAX_WAIT_MS", "5"))
+
+# Chunks are sentence-aligned and sized to the embedding model's input window
+# (256 word pieces for all-MiniLM-L6-v2); CHUNK_MAX_TOKENS=0 uses that limit
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "32"))
+
+# Vector search backend: numpy (exact), faiss_flat, faiss_ivf or faiss_hnsw,
+# or float16 / int8: rank quantized copies of the rows (2 / 1 bytes per
+# dimension), then rescore the best rerank_candidates exactly. Compare them
+# with manage.py evaluate_quantization.
+VECTOR_INDEX_BACKEND = os.environ.get("VECTOR_INDEX_BACKEND", "numpy")
+VECTOR_INDEX_OPTIONS = {
+    "ivf_nlist": int(os.environ.get("FAISS_IVF_NLIST", "256")),
+    "ivf_nprobe": int(os.environ.get("FAISS_IVF_NPROBE", "16")),
+    "hnsw_m": int(os.environ.get("FAISS_HNSW_M", "32")),
+    "hnsw_ef_construction": int(os.environ.get("FAISS_HNSW_EF_CONSTRUCTION", "80")),
+    "hnsw_ef_search": int(os.environ.get("FAISS_HNSW_EF_SEARCH", "64")),
+    # Filtered searches over at most this many rows are scored exactly
+    "brute_force_max": int(os.environ.get("FAISS_BRUTE_FORCE_MAX", "20000")),
+    # Appended rows are scored exactly until this many have piled up, then
+    # merged into a copy of the faiss index that replaces it for new searches
+    "merge_rows": int(os.environ.get("FAISS_MERGE_ROWS", "4096")),
+    # float16 / int8: rows shortlisted by the quantized pass (at least 2 * top_k)
+    "rerank_candidates": int(os.environ.get("VECTOR_RERANK_CANDIDATES", "100")),
+}
+
+# Hybrid retrieval: fuse the dense ranking with BM25 keyword matches (exact
+# identifiers, codes, names) by reciprocal rank fusion; each ranker
+# contributes its HYBRID_CANDIDATES best rows
+RETRIEVAL_HYBRID = os.environ.get("RETRIEVAL_HYBRID", "True") == "True"
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+# Chunks of deleted documents are skipped by searches at once and dropped by a
+# background compaction once they are VECTOR_COMPACT_RATIO of the store and at
+# least VECTOR_COMPACT_MIN_ROWS rows (ratio 0: only manage.py compact_vectorstore)
+VECTOR_COMPACT_RATIO = float(os.environ.get("VECTOR_COMPACT_RATIO", "0.2"))
+VECTOR_COMPACT_MIN_ROWS = int(os.environ.get("VECTOR_COMPACT_MIN_ROWS", "1000"))
+
+# LRU sizes for cached query embeddings and ranked search results (0 disables)
+RETRIEVAL_QUERY_CACHE_SIZE = int(os.environ.get("RETRIEVAL_QUERY_CACHE_SIZE", "1024"))
+RETRIEVAL_RESULT_CACHE_SIZE = int(os.environ.get("RETRIEVAL_RESULT_CACHE_SIZE", "1024"))
+
+# =========================
+# DOCUMENT INGESTION QUEUE
+# =========================
+
+# Run ingestion on a background thread pool (False = inline, e.g. for tests)
+INGESTION_ASYNC = os.environ.get("INGESTION_ASYNC", "True") == "True"
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "1"))
+# Chunks embedded and committed per step; each step is searchable immediately
+INGESTION_COMMIT_CHUNKS = int(os.environ.get("INGESTION_COMMIT_CHUNKS", "64"))
+# A processing job with no progress update for this long is picked up again
+INGESTION_STALE_SECONDS = int(os.environ.get("INGESTION_STALE_SECONDS", "600"))
+# PDFs with at least LOADER_PARALLEL_MIN_PAGES pages are extracted by a pool
+# of LOADER_PROCESSES processes, LOADER_PAGES_PER_TASK pages per task
+LOADER_PROCESSES = int(os.environ.get("LOADER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+LOADER_PARALLEL_MIN_PAGES = int(os.environ.get("LOADER_PARALLEL_MIN_PAGES", "64"))
+LOADER_PAGES_PER_TASK = int(os.environ.get("LOADER_PAGES_PER_TASK", "16"))
+
+# =========================
+# LLM CLIENT (Groq, OpenAI-compatible)
+# =========================
+
+LLM_TIMEOUT_SECONDS = float(os.environ.get("LLM_TIMEOUT_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+# Keep-alive pool shared by all requests in a worker process
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "50"))
+
+# Reuse the answer for an identical prompt (same model, temperature and
+# assembled prompt) instead of calling the LLM again. Off by default.
+LLM_ANSWER_CACHE = os.environ.get("LLM_ANSWER_CACHE", "False") == "True"
+LLM_ANSWER_CACHE_TTL = int(os.environ.get("LLM_ANSWER_CACHE_TTL", "3600"))
+LLM_ANSWER_CACHE_ALIAS = "llm"
+
+# =========================
+# CHAT UI
+# =========================
+
+# Messages / sidebar conversations per page; older pages load on scroll
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get("CHAT_HISTORY_PAGE_SIZE", "30"))
+CONVERSATION_PAGE_SIZE = int(os.environ.get("CONVERSATION_PAGE_SIZE", "30"))
+
+# =========================
+# CACHES
+# =========================
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # LLM answers; set LLM_CACHE_DIR to share them between worker processes
+    "llm": {
+        "BACKEND": (
+            "django.core.cache.backends.filebased.FileBasedCache"
+            if os.environ.get("LLM_CACHE_DIR")
+            else "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.environ.get("LLM_CACHE_DIR", "llm-answers"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.environ.get("LLM_ANSWER_CACHE_MAX_ENTRIES", "1000"))},
+    },
+}
+
 # =========================
 # LOGGING
 # =========================
@@ -1,8 +1,82 @@
+import json
 import os
+import sys
 from sentence_transformers import SentenceTransformer
 
-def download():
-    model_name = "all-MiniLM-L6-v2"
+ONNX_MODEL_FILE = "model-int8.onnx"
+
+
+def export_onnx(model, export_dir):
+    """
+    Export the transformer to ONNX and quantize its weights to int8.
+    Pooling and normalisation run in numpy at inference time (see
+    chatbot/rag/embeddings.OnnxEmbedder), so only the encoder is exported.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers.models import Normalize, Pooling
+
+    config = next(m for m in model if isinstance(m, Pooling)).get_config_dict()
+    # Newer sentence-transformers name the mode, older ones set one flag per mode
+    mode = config.get("pooling_mode") or ("mean" if config.get("pooling_mode_mean_tokens") else "other")
+    if mode != "mean":
+        raise ValueError(f"Only mean pooling is supported, got {mode}")
+
+    os.makedirs(export_dir, exist_ok=True)
+    tokenizer = model.tokenizer
+    sample = tokenizer(["An example sentence to trace the encoder."], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class Encoder(torch.nn.Module):
+        """Keyword-call the HF model (its positional order varies by version)"""
+
+        def __init__(self, transformer):
+            super().__init__()
+            self.transformer = transformer
+
+        def forward(self, *inputs):
+            return self.transformer(**dict(zip(input_names, inputs))).last_hidden_state
+
+    encoder = Encoder(model[0].auto_model).eval()
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+
+    fp32_path = os.path.join(export_dir, "model.onnx")
+    print(f"📦 Exporting ONNX encoder to {fp32_path}...")
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+            dynamo=False,
+        )
+
+    int8_path = os.path.join(export_dir, ONNX_MODEL_FILE)
+    print(f"🗜️ Quantizing weights to int8: {int8_path}...")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(export_dir)
+    with open(os.path.join(export_dir, "export.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "pooling": "mean",
+                "normalize": any(isinstance(m, Normalize) for m in model),
+                "max_seq_length": model.max_seq_length,
+                "pad_id": tokenizer.pad_token_id,
+                "pad_token": tokenizer.pad_token,
+            },
+            f,
+            indent=2,
+        )
+    print("✅ ONNX export ready.")
+
+
+def download(onnx=True):
+    model_name = os.environ.get("EMBEDDING_MODEL_NAME", "all-MiniLM-L6-v2")
     # Set cache dir to a local folder that will be part of the Docker image
     cache_dir = os.path.join(os.getcwd(), "model_cache")
     os.makedirs(cache_dir, exist_ok=True)
@@ -13,8 +87,15 @@ def download():
     os.environ['SENTENCE_TRANSFORMERS_HOME'] = cache_dir
     os.environ['TRANSFORMERS_CACHE'] = cache_dir
     
-    SentenceTransformer(model_name, cache_folder=cache_dir)
+    model = SentenceTransformer(model_name, cache_folder=cache_dir)
     print("✅ Model downloaded and cached successfully.")
 
+    if onnx:
+        try:
+            export_onnx(model, os.path.join(cache_dir, f"onnx-{os.path.basename(model_name)}"))
+        except ImportError as e:
+            # onnx / onnxruntime are optional; the torch backend still works
+            print(f"⚠️ Skipping ONNX export ({e})")
+
 if __name__ == "__main__":
-    download()
+    download(onnx="--no-onnx" not in sys.argv)
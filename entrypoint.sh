@@ -34,14 +34,28 @@ EOF
 # echo "🔄 Reloading documents into vector store..."
 # python manage.py reload_documents || echo "⚠️ Warning: Document reload failed, but continuing..."
 
-echo "Starting Gunicorn..."
+if [ -n "$EMBEDDING_SERVER_SOCKET" ]; then
+  echo "Starting embedding server on $EMBEDDING_SERVER_SOCKET..."
+  python manage.py run_embedding_server &
+  # The socket appears once the model is loaded; wait so workers connect to
+  # it instead of loading their own copy
+  for i in $(seq 1 60); do
+    [ -S "$EMBEDDING_SERVER_SOCKET" ] && break
+    sleep 1
+  done
+fi
+
+echo "Starting Gunicorn (ASGI / uvicorn workers)..."
 # Disable --preload to allow master to start instantly
 # Render's 512MB RAM is very tight for SentenceTransformers
-exec gunicorn chatbotapp.wsgi:application \
+# The async worker keeps many streaming LLM calls in flight on one event loop;
+# sync views and DB work run in its thread pool.
+# Workers share the memory-mapped vector store (vectorstore_data/), so adding
+# workers does not duplicate the embedding matrix; set WEB_CONCURRENCY to scale.
+exec gunicorn chatbotapp.asgi:application \
   --bind 0.0.0.0:$PORT \
-  --workers 1 \
-  --worker-class sync \
-  --threads 2 \
+  --workers ${WEB_CONCURRENCY:-1} \
+  --worker-class uvicorn_worker.UvicornWorker \
   --timeout 120 \
   --keep-alive 5 \
   --max-requests 100 \